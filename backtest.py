@@ -0,0 +1,295 @@
+"""Бэктест процентной сетки на исторических данных
+
+Прогоняет свечи или сделки (CSV/Parquet) через те же правила, что и trade_asset
+(strategy.py), с моделью исполнения limit ордеров.
+
+Запуск:
+    python backtest.py --data data/ --symbols AVAXUSDT,XRPUSDT --output result.json
+
+В папке data ожидаются файлы {SYMBOL}.csv, {SYMBOL}.csv.gz или {SYMBOL}.parquet.
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, Any, List, Optional
+import numpy as np
+import pandas as pd
+import strategy
+TIME_COLUMNS = ('start', 'startTime', 'open_time', 'timestamp', 'time', 'datetime')
+KLINE_COLUMNS = ['start', 'open', 'high', 'low', 'close', 'volume', 'turnover']
+DATA_EXTENSIONS = ('.parquet', '.csv', '.csv.gz')
+# Параметры символа, которого нет в конфигурации активов
+DEFAULT_ASSET_CONFIG = {'n_percent': 5, 'k_percent': 5, 'enabled': True, 'max_position': 2.0}
+def default_settings() -> Dict[str, Any]:
+    """Общие настройки бота для бэктеста"""
+    return {
+        'buy_percent': strategy.BUY_PERCENT,
+        'sell_percent': strategy.SELL_PERCENT,
+        'price_offset': strategy.PRICE_OFFSET,
+        'order_ttl': strategy.ORDER_TTL,
+        'min_lot_usd': strategy.MIN_LOT_USD,
+        'maker_fee': 0.0002,  # Комиссия мейкера Bybit 0.02%
+        'fill_mode': 'touch',  # touch - исполнение при касании цены, through - только при проходе сквозь
+        'interval': '1min'  # Период оценки (как пауза между торговыми циклами)
+    }
+def to_seconds(values: pd.Series) -> np.ndarray:
+    """Время в секундах из мс, секунд или строк с датой"""
+    if pd.api.types.is_numeric_dtype(values):
+        seconds = values.to_numpy(dtype=np.float64)
+        # Bybit отдает время в миллисекундах
+        if len(seconds) and np.nanmax(seconds) > 1e11:
+            seconds = seconds / 1000
+        return seconds
+    return pd.to_datetime(values, utc=True).astype('int64').to_numpy() / 1e9
+def load_prices(path: str, interval: str = '1min') -> pd.DataFrame:
+    """Загрузить свечи или сделки и привести к OHLC с колонкой ts (секунды)"""
+    if path.endswith('.parquet'):
+        frame = pd.read_parquet(path)
+    else:
+        frame = pd.read_csv(path)
+        # Свечи из API Bybit без заголовка
+        if not any(column in frame.columns for column in TIME_COLUMNS) and len(frame.columns) == len(KLINE_COLUMNS):
+            frame = pd.read_csv(path, header=None, names=KLINE_COLUMNS)
+    time_column = next((column for column in TIME_COLUMNS if column in frame.columns), None)
+    if time_column is None:
+        raise ValueError(f"{path}: нет колонки времени ({', '.join(TIME_COLUMNS)})")
+    frame = frame.assign(ts=to_seconds(frame[time_column]))
+    if 'close' in frame.columns:
+        prices = frame[['ts', 'open', 'high', 'low', 'close']].astype(np.float64)
+    elif 'price' in frame.columns:
+        # Сделки сворачиваем в свечи периода оценки
+        trades = pd.Series(frame['price'].astype(np.float64).to_numpy(),
+                           index=pd.to_datetime(frame['ts'], unit='s', utc=True)).sort_index()
+        ohlc = trades.resample(interval).ohlc().dropna()
+        prices = ohlc.assign(ts=ohlc.index.astype('int64') / 1e9).reset_index(drop=True)
+        prices = prices[['ts', 'open', 'high', 'low', 'close']]
+    else:
+        raise ValueError(f"{path}: нужны колонки close (свечи) или price (сделки)")
+    prices = prices.sort_values('ts').drop_duplicates('ts', keep='last').reset_index(drop=True)
+    return prices.dropna()
+def find_data_file(data_dir: str, symbol: str) -> Optional[str]:
+    """Файл с данными символа"""
+    for extension in DATA_EXTENSIONS:
+        path = os.path.join(data_dir, symbol + extension)
+        if os.path.exists(path):
+            return path
+    return None
+def first_true(mask, start: int, n: int, chunk: int = 1024) -> int:
+    """Первый индекс >= start, где mask(begin, end) истинна; n если такого нет
+
+    Поиск идет окнами растущего размера, поэтому стоимость пропорциональна
+    расстоянию до события, а не длине истории.
+    """
+    i = start
+    while i < n:
+        end = min(n, i + chunk)
+        hits = np.flatnonzero(mask(i, end))
+        if hits.size:
+            return i + int(hits[0])
+        i = end
+        chunk *= 2
+    return n
+def backtest_symbol(ts: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                    config: Dict[str, Any], settings: Dict[str, Any], instrument: Dict[str, float] = None) -> Dict[str, Any]:
+    """Прогон одного символа через правила trade_asset
+
+    Оценка выполняется на закрытии каждой свечи, но цикл перескакивает между
+    свечами, где состояние может измениться: пересечение уровня, исполнение или
+    истечение ордера, суточный сброс цены отсчета.
+    """
+    n = len(close)
+    k_percent = config['k_percent']
+    n_percent = config['n_percent']
+    max_position = config['max_position']
+    buy_percent = settings['buy_percent']
+    sell_percent = settings['sell_percent']
+    price_offset = settings['price_offset']
+    order_ttl = settings['order_ttl']
+    maker_fee = settings['maker_fee']
+    through = settings['fill_mode'] == 'through'
+    # Фильтры инструмента и лоты считаются один раз при старте, как в initialize_asset_lots
+    quantizer = strategy.build_quantizer(instrument or strategy.DEFAULT_INSTRUMENT)
+    min_lot = float(quantizer.min_lot(settings['min_lot_usd'], close[0] if n else 0))
+    position = 0.0
+    avg_price = 0.0
+    reference_price = 0.0
+    last_update = ts[0] if n else 0
+    order = None  # (side, qty, price, timestamp)
+    realized = 0.0
+    fees = 0.0
+    turnover = 0.0
+    buys = sells = cancelled = 0
+    # Точки изменения позиции для кривой капитала
+    change_index = [0]
+    change_position = [0.0]
+    change_avg = [0.0]
+    change_realized = [0.0]
+    def evaluate(i: int):
+        nonlocal reference_price, last_update, order, cancelled
+        current_price = close[i]
+        now = ts[i]
+        if reference_price == 0:
+            reference_price = current_price
+        buy_price_level, sell_price_level = strategy.price_levels(reference_price, avg_price, k_percent, n_percent)
+        if now - last_update > strategy.REFERENCE_RESET_INTERVAL:
+            reference_price = current_price
+            last_update = now
+        if order is not None:
+            if now - order[3] > order_ttl:
+                order = None
+                cancelled += 1
+            else:
+                return
+        decision = strategy.decide_order(current_price, position, avg_price, buy_price_level, sell_price_level,
+                                         min_lot, max_position, k_percent, buy_percent, sell_percent, price_offset)
+        if decision:
+            side, lot_size, order_price = decision
+            # Цена и количество так, как их отправляет place_limit_order
+            order_price = quantizer.order_price(order_price, side)
+            qty = quantizer.order_qty(lot_size, float(order_price), side == 'Sell' and position > 0, position)
+            order = (side, float(qty), float(order_price), now)
+    def fill(i: int):
+        nonlocal position, avg_price, realized, fees, turnover, order, buys, sells
+        side, qty, price, _ = order
+        if side == 'Buy':
+            avg_price = (position * avg_price + qty * price) / (position + qty)
+            position += qty
+            buys += 1
+        else:
+            # reduceOnly: нельзя продать больше позиции
+            qty = min(qty, position)
+            realized += qty * (price - avg_price)
+            position -= qty
+            if position <= 1e-12:
+                position = 0.0
+                avg_price = 0.0
+            sells += 1
+        fees += qty * price * maker_fee
+        turnover += qty * price
+        order = None
+        change_index.append(i)
+        change_position.append(position)
+        change_avg.append(avg_price)
+        change_realized.append(realized - fees)
+    i = 0
+    while i < n:
+        evaluate(i)
+        start = i + 1
+        # Суточный сброс цены отсчета - событие по времени
+        next_event = int(np.searchsorted(ts, last_update + strategy.REFERENCE_RESET_INTERVAL, side='right'))
+        if order is not None:
+            side, _, order_price, placed = order
+            if side == 'Buy':
+                touched = (lambda a, b: low[a:b] < order_price) if through else (lambda a, b: low[a:b] <= order_price)
+            else:
+                touched = (lambda a, b: high[a:b] > order_price) if through else (lambda a, b: high[a:b] >= order_price)
+            expiry = int(np.searchsorted(ts, placed + order_ttl, side='right'))
+            next_event = min(next_event, expiry)
+            # Исполнение внутри свечи происходит раньше оценки на ее закрытии
+            end = min(n, next_event + 1)
+            fill_at = first_true(touched, start, end)
+            if fill_at < end:
+                fill(fill_at)
+                i = fill_at
+                continue
+        else:
+            # Без ордера оценка меняет состояние только при выходе цены за уровни
+            buy_price_level, sell_price_level = strategy.price_levels(reference_price, avg_price, k_percent, n_percent)
+            buy_threshold = -np.inf
+            if abs(position) <= max_position - min_lot:
+                buy_threshold = buy_price_level
+                if position > 0:
+                    buy_threshold = min(buy_price_level, avg_price * (1 - k_percent / 100)) if avg_price > 0 else -np.inf
+            sell_threshold = np.inf
+            if position > 0 and avg_price > 0 and abs(position) >= min_lot:
+                sell_threshold = sell_price_level
+            if buy_threshold > -np.inf or sell_threshold < np.inf:
+                crossing = first_true(lambda a, b: (close[a:b] < buy_threshold) | (close[a:b] > sell_threshold),
+                                      start, min(n, next_event))
+                next_event = min(next_event, crossing)
+        i = max(next_event, start)
+    # Кривая капитала: состояние между изменениями постоянно
+    segment = np.searchsorted(np.asarray(change_index), np.arange(n), side='right') - 1
+    equity = (np.asarray(change_realized)[segment] +
+              np.asarray(change_position)[segment] * (close - np.asarray(change_avg)[segment]))
+    max_drawdown = float(np.max(np.maximum.accumulate(equity) - equity)) if n else 0.0
+    unrealized = float(position * (close[-1] - avg_price)) if n and position else 0.0
+    return {
+        'bars': n,
+        'min_lot': min_lot,
+        'buys': buys,
+        'sells': sells,
+        'cancelled_orders': cancelled,
+        'realized_pnl': realized,
+        'unrealized_pnl': unrealized,
+        'fees': fees,
+        'total_pnl': realized + unrealized - fees,
+        'max_drawdown': max_drawdown,
+        'turnover': turnover,
+        'final_position': position,
+        'avg_price': avg_price
+    }
+def load_assets_config(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """Конфигурация активов из файла или по умолчанию"""
+    if not path:
+        return strategy.DEFAULT_ASSETS_CONFIG
+    return strategy.load_assets_file(path)
+def load_instruments(path: Optional[str]) -> Dict[str, Dict[str, float]]:
+    """Фильтры инструментов (шаги, минимумы, maxOrderQty, minNotional) из кэша бота"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('instruments', {})
+def run_backtest(data_dir: str, symbols: List[str], assets_config: Dict[str, Dict[str, Any]],
+                 settings: Dict[str, Any], instruments: Dict[str, Dict[str, float]] = None) -> Dict[str, Any]:
+    """Бэктест списка символов"""
+    instruments = instruments or {}
+    results = {}
+    for symbol in symbols:
+        path = find_data_file(data_dir, symbol)
+        if path is None:
+            print(f"[{symbol}] Нет данных в {data_dir}")
+            continue
+        prices = load_prices(path, settings['interval'])
+        results[symbol] = backtest_symbol(
+            prices['ts'].to_numpy(),
+            prices['high'].to_numpy(),
+            prices['low'].to_numpy(),
+            prices['close'].to_numpy(),
+            assets_config.get(symbol, DEFAULT_ASSET_CONFIG),
+            settings,
+            instruments.get(symbol)
+        )
+    return results
+def main():
+    parser = argparse.ArgumentParser(description="Бэктест процентной сетки")
+    parser.add_argument('--data', required=True, help="Папка с файлами {SYMBOL}.csv/.parquet")
+    parser.add_argument('--symbols', help="Символы через запятую (по умолчанию все включенные)")
+    parser.add_argument('--config', help="Конфигурация активов: JSON, YAML или CSV")
+    parser.add_argument('--instruments', default='instruments_cache.json', help="Кэш инструментов с фильтрами ордеров")
+    parser.add_argument('--output', help="Файл для результатов в JSON")
+    defaults = default_settings()
+    for key, value in defaults.items():
+        value_type = str if isinstance(value, str) else float
+        parser.add_argument(f"--{key.replace('_', '-')}", type=value_type, default=value)
+    args = parser.parse_args()
+    settings = {key: getattr(args, key) for key in defaults}
+    assets_config = load_assets_config(args.config)
+    if args.symbols:
+        symbols = [symbol.strip() for symbol in args.symbols.split(',') if symbol.strip()]
+    else:
+        symbols = [symbol for symbol, config in assets_config.items() if config.get('enabled', False)]
+    started = time.perf_counter()
+    results = run_backtest(args.data, symbols, assets_config, settings, load_instruments(args.instruments))
+    elapsed = time.perf_counter() - started
+    print(f"{'Символ':<12} {'PnL':>12} {'Просадка':>12} {'Оборот':>14} {'Покупок':>8} {'Продаж':>8}")
+    for symbol, result in results.items():
+        print(f"{symbol:<12} {result['total_pnl']:>12.4f} {result['max_drawdown']:>12.4f} "
+              f"{result['turnover']:>14.2f} {result['buys']:>8} {result['sells']:>8}")
+    print(f"Итого PnL: {sum(result['total_pnl'] for result in results.values()):.4f}, время {elapsed:.2f} сек")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=2)
+if __name__ == "__main__":
+    main()
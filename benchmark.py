@@ -0,0 +1,259 @@
+"""Замеры производительности бота на имитации биржи
+
+Меряет:
+  - время торгового цикла в зависимости от числа символов;
+  - задержку от решения trade_asset до приема ордера имитацией биржи;
+  - стоимость одного вызова trade_asset;
+  - сборку get_status и сериализацию в JSON;
+  - пропускную способность рассылки /ws в зависимости от числа клиентов.
+
+Результаты сохраняются в JSON, --compare печатает изменения относительно
+предыдущего прогона.
+
+Запуск:
+    python benchmark.py --output bench.json --compare bench_prev.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+# Бот при импорте main создается сразу, поэтому окружение задается заранее
+os.environ['EXCHANGE'] = 'mock'
+os.environ['TICKER_STREAM'] = '0'
+os.environ['PRIVATE_STREAM'] = '0'
+os.environ['STATE_DB'] = ''
+os.environ['CONFIG_FILE'] = ''
+os.environ.setdefault('INSTRUMENTS_CACHE_FILE', os.path.join(tempfile.gettempdir(), 'bench_instruments_cache.json'))
+import main
+from mock_exchange import MockExchange
+def make_bot(symbol_count: int, latency: float = 0.0, concurrency: int = 8) -> main.MultiAssetTradingBot:
+    """Бот на имитации биржи с symbol_count синтетическими символами"""
+    symbols = [f"SYM{i:04d}USDT" for i in range(symbol_count)]
+    exchange = MockExchange(symbols, latency=latency, seed=1)
+    bot = main.MultiAssetTradingBot(session=exchange)
+    bot.config = bot.config.replace(assets={
+        symbol: {'n_percent': 3, 'k_percent': 2, 'enabled': True, 'max_position': 1000.0} for symbol in symbols
+    })
+    bot.assets_data = main.AssetStore()
+    for symbol in symbols:
+        bot.assets_data[symbol] = bot.new_asset_data()
+    bot.instruments = {}
+    bot.instruments_time = 0
+    bot.max_concurrency = concurrency
+    bot.trade_semaphore = asyncio.Semaphore(concurrency)
+    # Темп запросов не ограничиваем: меряем сам бот, а не лимиты биржи
+    bot.scheduler.global_budget = main.RateBudget(1e9)
+    bot.scheduler.limits = {name: 1e9 for name in bot.scheduler.limits}
+    bot.scheduler.DEFAULT_LIMIT = 1e9
+    bot.ticker_stream_enabled = False
+    bot.event_driven = False
+    bot.private_stream = None
+    bot.trading_active = True
+    bot.initialize_asset_lots()
+    return bot
+def seed_signals(bot: main.MultiAssetTradingBot):
+    """Цена отсчета выше рынка на 2 * k_percent: decide_order сразу решает покупку"""
+    bot.refresh_price_snapshot()
+    now = time.time()
+    for symbol, config in bot.assets_config.items():
+        asset_data = bot.assets_data[symbol]
+        asset_data['reference_price'] = bot.price_snapshot[symbol] * (1 + 2 * config['k_percent'] / 100)
+        asset_data['last_update'] = now
+def summarize(samples: List[float], prefix: str) -> Dict[str, float]:
+    return {
+        f"{prefix}.mean": statistics.mean(samples),
+        f"{prefix}.min": min(samples),
+        f"{prefix}.p50": statistics.median(samples),
+        f"{prefix}.p95": statistics.quantiles(samples, n=20)[-1] if len(samples) > 1 else samples[0],
+        f"{prefix}.max": max(samples)
+    }
+def track_decisions(bot: main.MultiAssetTradingBot) -> Dict[tuple, float]:
+    """Запоминать время решения (вызова place_limit_order) по (symbol, side)"""
+    decisions = {}
+    place_limit_order = bot.place_limit_order
+    def timed(symbol: str, side: str, qty: float, price: float) -> str:
+        decisions[(symbol, side)] = time.perf_counter()
+        return place_limit_order(symbol, side, qty, price)
+    bot.place_limit_order = timed
+    return decisions
+def order_latencies(bot: main.MultiAssetTradingBot, decisions: Dict[tuple, float]) -> List[float]:
+    """Задержки решение-ордер по журналу принятых ордеров имитации (журнал очищается)"""
+    latencies = []
+    order_log = bot.session.order_log
+    while order_log:
+        symbol, side, received = order_log.popleft()
+        decided = decisions.pop((symbol, side), None)
+        if decided is not None:
+            latencies.append(received - decided)
+    return latencies
+async def bench_cycle(sizes: List[int], latency: float, concurrency: int, repeats: int) -> Dict[str, float]:
+    """Время торгового цикла в зависимости от числа символов"""
+    results = {}
+    for size in sizes:
+        bot = make_bot(size, latency, concurrency)
+        decisions = track_decisions(bot)
+        # Прогрев: каждый символ ставит ордер, по ним меряем задержку решение-ордер,
+        # в замеряемых циклах символы уже ждут исполнения
+        seed_signals(bot)
+        await bot.trading_cycle_once()
+        latencies = order_latencies(bot, decisions)
+        samples = []
+        for _ in range(repeats):
+            # Снимки устаревают между циклами, как в работе бота
+            bot.price_snapshot_time = 0
+            bot.position_snapshot_time = 0
+            started = time.perf_counter()
+            await bot.trading_cycle_once()
+            samples.append(time.perf_counter() - started)
+            latencies.extend(order_latencies(bot, decisions))
+        results.update(summarize(samples, f"cycle.{size}.seconds"))
+        if latencies:
+            results.update(summarize(latencies, f"cycle.{size}.decision_to_order_seconds"))
+            print(f"Решение-ордер, {size} символов: p50 {statistics.median(latencies) * 1000:.1f} мс, "
+                  f"p95 {results[f'cycle.{size}.decision_to_order_seconds.p95'] * 1000:.1f} мс")
+        results[f"cycle.{size}.requests"] = sum(bot.session.request_counts.values()) / (repeats + 1)
+        print(f"Цикл, {size} символов: {statistics.mean(samples) * 1000:.1f} мс")
+    return results
+def bench_trade_asset(size: int, repeats: int) -> Dict[str, float]:
+    """Стоимость одного вызова trade_asset при свежих снимках: без сигнала и с размещением ордера"""
+    bot = make_bot(size)
+    bot.refresh_price_snapshot()
+    bot.refresh_position_snapshot()
+    bot.cycle_interval = 1e9  # Снимки не устаревают во время замера
+    symbols = list(bot.assets_config.keys())
+    results = {}
+    for path in ('quiet', 'order'):
+        samples = []
+        for _ in range(repeats):
+            if path == 'order':
+                # Сигнал на покупку: вызов проходит округление, шлюз ордеров и отправку
+                seed_signals(bot)
+            for symbol in symbols:
+                # Активный ордер оставляет символ в ожидании, сбрасываем его
+                bot.assets_data[symbol]['active_order'] = None
+                started = time.perf_counter()
+                bot.trade_asset(symbol)
+                samples.append(time.perf_counter() - started)
+        results.update(summarize(samples, f"trade_asset.{path}.seconds"))
+        print(f"trade_asset ({path}): {statistics.mean(samples) * 1e6:.1f} мкс")
+    return results
+def bench_status(sizes: List[int], repeats: int) -> Dict[str, float]:
+    """Сборка статуса, сериализация и чтение из кэша"""
+    results = {}
+    for size in sizes:
+        bot = make_bot(size)
+        build, serialize, cached = [], [], []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            status = bot.build_status()
+            built = time.perf_counter()
+            json.dumps(status)
+            serialize.append(time.perf_counter() - built)
+            build.append(built - started)
+            bot.mark_changed()
+            bot.get_status_snapshot()
+            started = time.perf_counter()
+            bot.get_status_snapshot()
+            cached.append(time.perf_counter() - started)
+        results.update(summarize(build, f"status.{size}.build_seconds"))
+        results.update(summarize(serialize, f"status.{size}.json_seconds"))
+        results.update(summarize(cached, f"status.{size}.cached_seconds"))
+        print(f"get_status, {size} символов: сборка {statistics.mean(build) * 1000:.2f} мс, "
+              f"JSON {statistics.mean(serialize) * 1000:.2f} мс, кэш {statistics.mean(cached) * 1e6:.1f} мкс")
+    return results
+class NullClient:
+    """WebSocket клиент, принимающий сообщения без задержки"""
+    def __init__(self):
+        self.received = 0
+    async def send_text(self, message: str):
+        self.received += 1
+    async def close(self):
+        pass
+async def bench_broadcast(client_counts: List[int], messages: int, size: int) -> Dict[str, float]:
+    """Пропускная способность рассылки дельт статуса"""
+    results = {}
+    bot = make_bot(size)
+    symbols = list(bot.assets_config.keys())
+    for count in client_counts:
+        hub = main.StatusHub(queue_size=messages + 1)
+        clients = [NullClient() for _ in range(count)]
+        senders = [asyncio.create_task(hub.sender(client, hub.register(client))) for client in clients]
+        hub.publish(bot.build_status())
+        started = time.perf_counter()
+        for i in range(messages):
+            bot.assets_data[symbols[i % len(symbols)]]['last_price'] += 1
+            hub.publish(bot.build_status())
+            await asyncio.sleep(0)
+        # Ждем, пока все клиенты получат все сообщения
+        while any(client.received < messages for client in clients):
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - started
+        for sender in senders:
+            sender.cancel()
+        results[f"broadcast.{count}.seconds"] = elapsed
+        results[f"broadcast.{count}.messages_per_second"] = count * messages / elapsed
+        print(f"Рассылка, {count} клиентов: {count * messages / elapsed:.0f} сообщений/сек")
+    return results
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+def compare(current: Dict[str, float], previous_path: str):
+    """Печать изменений метрик относительно предыдущего прогона"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    print(f"Сравнение с {previous_path} ({previous.get('revision', '?')}):")
+    for key, value in current.items():
+        old = previous.get('results', {}).get(key)
+        if old:
+            print(f"  {key:<45} {old:>14.6g} -> {value:>14.6g} ({(value - old) / old * 100:+.1f}%)")
+def parse_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(',') if part.strip()]
+async def run(args) -> Dict[str, float]:
+    results = {}
+    results.update(await bench_cycle(parse_list(args.sizes), args.latency, args.concurrency, args.repeats))
+    results.update(bench_trade_asset(22, args.repeats))
+    results.update(bench_status(parse_list(args.sizes), args.repeats * 5))
+    results.update(await bench_broadcast(parse_list(args.clients), args.messages, 22))
+    return results
+def main_cli():
+    parser = argparse.ArgumentParser(description="Замеры производительности бота")
+    parser.add_argument('--sizes', default='22,100,500', help="Числа символов через запятую")
+    parser.add_argument('--clients', default='1,10,100,1000', help="Числа клиентов /ws через запятую")
+    parser.add_argument('--latency', type=float, default=0.02, help="Задержка ответа имитации биржи (сек)")
+    parser.add_argument('--concurrency', type=int, default=8, help="MAX_CONCURRENCY бота")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=100, help="Сообщений на замер рассылки")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="JSON предыдущего прогона")
+    parser.add_argument('--log', action='store_true', help="Не отключать INFO логи бота")
+    args = parser.parse_args()
+    if not args.log:
+        logging.disable(logging.INFO)
+    results = asyncio.run(run(args))
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'params': vars(args),
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Результаты записаны в {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+if __name__ == "__main__":
+    main_cli()
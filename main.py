@@ -6,22 +6,99 @@ from pybit.unified_trading import HTTP
 from collections import deque
 from dotenv import load_dotenv
 import asyncio
+import atexit
+import bisect
+import concurrent.futures
+import copy
+import hashlib
+import hmac
+import itertools
 import json
-from typing import Dict, Any, List
+import threading
+from typing import Dict, Any, List, Callable
 import logging
+import logging.handlers
+import queue
+import sqlite3
+import websockets
+from types import MappingProxyType
+from urllib.parse import urlparse
 from pydantic import BaseModel
-# Настройка логирования без эмодзи
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('trading_bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+import strategy
 # Загрузка переменных окружения
 load_dotenv()
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON"""
+    STANDARD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'sampled'}
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        # Поля из extra (например, symbol) попадают в запись как есть
+        for key, value in vars(record).items():
+            if key not in self.STANDARD_FIELDS:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+class SamplingFilter(logging.Filter):
+    """Повторяющиеся сообщения (extra sampled=True) не чаще раза в interval секунд на символ"""
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self.last_emitted = {}  # {(шаблон, аргументы): время}
+        self.suppressed = {}  # {(шаблон, аргументы): пропущено повторов}
+        self.lock = threading.Lock()
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'sampled', False) or self.interval <= 0:
+            return True
+        key = (record.msg, record.args)
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_emitted.get(key, -self.interval) < self.interval:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                return False
+            self.last_emitted[key] = now
+            suppressed = self.suppressed.pop(key, 0)
+        if suppressed:
+            record.msg = f"{record.msg} (пропущено повторов: {suppressed})"
+        return True
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Передает запись в очередь без форматирования, строку собирает фоновый поток"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+def setup_logging() -> logging.handlers.QueueListener:
+    """Логирование через очередь: файл и консоль пишет фоновый поток"""
+    if os.getenv('LOG_FORMAT', 'text') == 'json':
+        formatter = JsonFormatter()
+    else:
+        # Настройка логирования без эмодзи
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    log_file = os.getenv('LOG_FILE', 'trading_bot.log')
+    backup_count = int(os.getenv('LOG_BACKUP_COUNT', 5))
+    if os.getenv('LOG_ROTATION', 'size') == 'time':
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=os.getenv('LOG_ROTATE_WHEN', 'midnight'), backupCount=backup_count, encoding='utf-8')
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)), backupCount=backup_count, encoding='utf-8')
+    handlers = [file_handler, logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(SamplingFilter(float(os.getenv('LOG_SAMPLE_INTERVAL', 300))))
+    root = logging.getLogger()
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Дописываем очередь при завершении процесса
+    atexit.register(listener.stop)
+    return listener
+log_listener = setup_logging()
+logger = logging.getLogger(__name__)
 class PasswordCheck(BaseModel):
     password: str
 class AssetConfigUpdate(BaseModel):
@@ -35,136 +112,1630 @@ class ConfigUpdate(BaseModel):
     sell_percent: float = None
     price_offset: float = None
     min_lot_usd: float = None
-class MultiAssetTradingBot:
+    reprice_threshold: float = None
+class RateBudget:
+    """Бюджет запросов к API (token bucket), вызывается под блокировкой планировщика"""
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate  # Запросов в секунду
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0  # Биржа сообщила об исчерпании лимита до этого времени (time.time)
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    def wait_time(self) -> float:
+        """Сколько ждать до свободного токена (0 - можно сейчас)"""
+        self._refill()
+        blocked = max(0.0, self.blocked_until - time.time())
+        return max(blocked, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0)
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+class Histogram:
+    """Гистограмма значений с границами корзин как в Prometheus"""
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+class Metrics:
+    """Счетчики, значения и гистограммы для /metrics в текстовом формате Prometheus"""
+    LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    def __init__(self):
+        self.lock = threading.Lock()  # trade_asset пишет метрики из потоков
+        self.descriptions = {}  # {name: (type, help)}
+        self.series = {}  # {name: {labels: значение или Histogram}}
+    def describe(self, name: str, kind: str, help_text: str):
+        self.descriptions[name] = (kind, help_text)
+        self.series.setdefault(name, {})
+    @staticmethod
+    def label_key(labels: Dict[str, Any]) -> tuple:
+        return tuple(sorted((labels or {}).items()))
+    def inc(self, name: str, labels: Dict[str, Any] = None, value: float = 1):
+        key = self.label_key(labels)
+        with self.lock:
+            series = self.series.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+    def set(self, name: str, value: float, labels: Dict[str, Any] = None):
+        key = self.label_key(labels)
+        with self.lock:
+            self.series.setdefault(name, {})[key] = value
+    def observe(self, name: str, value: float, labels: Dict[str, Any] = None):
+        key = self.label_key(labels)
+        with self.lock:
+            series = self.series.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(self.LATENCY_BUCKETS)
+            series[key].observe(value)
+    @staticmethod
+    def format_labels(key: tuple, extra: tuple = ()) -> str:
+        items = key + extra
+        if not items:
+            return ''
+        return '{' + ','.join(f'{name}="{str(value)}"' for name, value in items) + '}'
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        with self.lock:
+            for name, series in self.series.items():
+                kind, help_text = self.descriptions.get(name, ('untyped', ''))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in series.items():
+                    if isinstance(value, Histogram):
+                        cumulative = 0
+                        for bound, count in zip(value.buckets + ('+Inf',), value.counts):
+                            cumulative += count
+                            lines.append(f"{name}_bucket{self.format_labels(key, (('le', bound),))} {cumulative}")
+                        lines.append(f"{name}_sum{self.format_labels(key)} {value.sum}")
+                        lines.append(f"{name}_count{self.format_labels(key)} {value.count}")
+                    else:
+                        lines.append(f"{name}{self.format_labels(key)} {value}")
+        return '\n'.join(lines) + '\n'
+class InstrumentedSession:
+    """Сессия биржи с замером задержек и ошибок каждого запроса"""
+    API_PREFIXES = ('get_', 'place_', 'cancel_', 'amend_')
+    def __init__(self, session, metrics: Metrics):
+        self.session = session
+        self.metrics = metrics
+        # pybit ходит в API через requests.Session: лимиты читаем из заголовков ответа
+        client = getattr(session, 'client', None)
+        if client is not None and hasattr(client, 'hooks'):
+            client.hooks['response'].append(self.on_response)
+    def __getattr__(self, name: str):
+        attr = getattr(self.session, name)
+        if not name.startswith(self.API_PREFIXES) or not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                response = attr(*args, **kwargs)
+            except Exception as e:
+                self.metrics.inc('bybit_errors_total', {'endpoint': name, 'type': type(e).__name__})
+                raise
+            finally:
+                self.metrics.observe('bybit_request_seconds', time.perf_counter() - start, {'endpoint': name})
+            if isinstance(response, dict) and response.get('retCode', 0) != 0:
+                self.metrics.inc('bybit_errors_total', {'endpoint': name, 'type': f"retCode_{response['retCode']}"})
+            return response
+        return call
+    def on_response(self, response, *args, **kwargs):
+        """Остаток лимита запросов из заголовков X-Bapi-Limit-*"""
+        try:
+            remaining = response.headers.get('X-Bapi-Limit-Status')
+            if remaining is not None:
+                path = urlparse(response.url).path
+                self.metrics.set('bybit_rate_limit_remaining', float(remaining), {'path': path})
+                limit = response.headers.get('X-Bapi-Limit')
+                if limit is not None:
+                    self.metrics.set('bybit_rate_limit', float(limit), {'path': path})
+        except Exception as e:
+            logger.error(f"Ошибка чтения лимитов запросов: {e}")
+class RequestScheduler:
+    """Все запросы к бирже: лимиты по методам, приоритеты и объединение одинаковых чтений"""
+    # Лимиты Bybit v5 на UID (запросов в секунду), остальные методы - DEFAULT_LIMIT
+    ENDPOINT_LIMITS = {
+        'place_order': 10,
+        'amend_order': 10,
+        'cancel_order': 10,
+        'place_batch_order': 10,
+        'amend_batch_order': 10,
+        'cancel_batch_order': 10,
+        'cancel_all_orders': 10,
+        'get_open_orders': 50,
+        'get_positions': 50,
+        'get_wallet_balance': 50,
+        'get_executions': 50,
+    }
+    DEFAULT_LIMIT = 20
+    RATE_LIMIT_CODE = 10006  # Bybit: слишком много запросов
+    def __init__(self, session, metrics: Metrics, global_rate: float, limits: Dict[str, float] = None):
+        self.session = session
+        self.metrics = metrics
+        self.limits = {**self.ENDPOINT_LIMITS, **(limits or {})}
+        self.global_budget = RateBudget(global_rate)  # Лимит Bybit на IP для всех запросов
+        self.budgets = {}  # {метод: RateBudget}
+        self.condition = threading.Condition()
+        self.waiting = []  # [(приоритет, номер, метод)] запросы в ожидании токенов
+        self.counter = itertools.count()
+        self.inflight = {}  # {ключ чтения: Future} для объединения одинаковых запросов
+        self.local = threading.local()  # Метод текущего запроса для обработчика заголовков
+        client = getattr(session, 'client', None)
+        if client is not None and hasattr(client, 'hooks'):
+            client.hooks['response'].append(self.on_response)
+    @staticmethod
+    def priority(name: str) -> int:
+        """Отмена и изменение ордеров первыми, справочные чтения последними"""
+        if name.startswith(('cancel_', 'amend_')):
+            return 0
+        if name.startswith('place_'):
+            return 1
+        if name in ('get_wallet_balance', 'get_instruments_info'):
+            return 3
+        return 2
+    def budget(self, name: str) -> RateBudget:
+        if name not in self.budgets:
+            self.budgets[name] = RateBudget(self.limits.get(name, self.DEFAULT_LIMIT))
+        return self.budgets[name]
+    def ready(self, name: str) -> float:
+        return max(self.global_budget.wait_time(), self.budget(name).wait_time())
+    def acquire(self, name: str):
+        """Дождаться токенов метода и общего лимита с учетом приоритета"""
+        ticket = (self.priority(name), next(self.counter), name)
+        with self.condition:
+            self.waiting.append(ticket)
+            try:
+                while True:
+                    delay = self.ready(name)
+                    # Запрос с более высоким приоритетом, который может идти, проходит первым
+                    ahead = any(other < ticket and self.ready(other[2]) == 0 for other in self.waiting)
+                    if delay == 0 and not ahead:
+                        break
+                    self.condition.wait(timeout=max(delay, 0.001) if not ahead else 0.05)
+                self.global_budget.take()
+                self.budget(name).take()
+            finally:
+                self.waiting.remove(ticket)
+                self.condition.notify_all()
+    def __getattr__(self, name: str):
+        attr = getattr(self.session, name)
+        if not name.startswith(InstrumentedSession.API_PREFIXES) or not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            if not name.startswith('get_'):
+                return self.execute(name, attr, args, kwargs)
+            try:
+                key = (name, args, tuple(sorted(kwargs.items())))
+                hash(key)
+            except TypeError:
+                return self.execute(name, attr, args, kwargs)
+            # Одинаковое чтение уже выполняется - ждем его результат
+            with self.condition:
+                future = self.inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = self.inflight[key] = concurrent.futures.Future()
+            if not owner:
+                self.metrics.inc('scheduler_coalesced_total', {'endpoint': name})
+                return future.result()
+            try:
+                result = self.execute(name, attr, args, kwargs)
+                future.set_result(result)
+                return result
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            finally:
+                with self.condition:
+                    self.inflight.pop(key, None)
+        return call
+    def execute(self, name: str, method: Callable, args: tuple, kwargs: Dict[str, Any]):
+        start = time.perf_counter()
+        self.acquire(name)
+        self.metrics.observe('scheduler_wait_seconds', time.perf_counter() - start, {'endpoint': name})
+        self.local.endpoint = name
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            # Лимит превышен: метод ждет секунду, как окно лимитов Bybit
+            if getattr(e, 'status_code', None) == self.RATE_LIMIT_CODE:
+                with self.condition:
+                    self.budget(name).blocked_until = max(self.budget(name).blocked_until, time.time() + 1)
+            raise
+        finally:
+            self.local.endpoint = None
+    def on_response(self, response, *args, **kwargs):
+        """Лимит и остаток из X-Bapi-Limit-* уточняют бюджет метода"""
+        name = getattr(self.local, 'endpoint', None)
+        if not name:
+            return
+        try:
+            remaining = response.headers.get('X-Bapi-Limit-Status')
+            if remaining is None:
+                return
+            limit = response.headers.get('X-Bapi-Limit')
+            reset = response.headers.get('X-Bapi-Limit-Reset-Timestamp')
+            with self.condition:
+                budget = self.budget(name)
+                if limit is not None and float(limit) > 0:
+                    budget.rate = budget.capacity = float(limit)
+                budget._refill()
+                budget.tokens = min(budget.tokens, float(remaining))
+                if float(remaining) <= 0 and reset is not None:
+                    budget.blocked_until = float(reset) / 1000
+        except Exception as e:
+            logger.error(f"Ошибка чтения лимитов запросов: {e}")
+    def tokens(self) -> Dict[str, float]:
+        """Свободные токены по методам для /metrics"""
+        with self.condition:
+            self.global_budget._refill()
+            result = {'all': self.global_budget.tokens}
+            for name, budget in self.budgets.items():
+                budget._refill()
+                result[name] = budget.tokens
+            return result
+class OrderRejectedError(Exception):
+    """Биржа отклонила ордер или отмену из пачки"""
+    def __init__(self, message: str, status_code: int):
+        super().__init__(f"{message} (ErrCode: {status_code})")
+        self.status_code = status_code
+class OrderGateway:
+    """Собирает ордера и отмены за короткое окно и отправляет их пачками; одиночный запрос уходит сразу"""
+    def __init__(self, session, window: float = 0.05, batch_size: int = 10):
+        self.session = session
+        self.window = window  # Окно сбора пачки (сек), 0 - отправка сразу
+        self.batch_size = batch_size  # Bybit принимает до 20 ордеров linear в одной пачке
+        self.lock = threading.Lock()
+        self.pending = {'place': [], 'cancel': []}  # [(запрос, Future)]
+        self.in_flight = {'place': 0, 'cancel': 0}  # Отправленные запросы без ответа
+    def place(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Разместить ордер, ответ как у place_order"""
+        return self.submit('place', request)
+    def cancel(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Отменить ордер, ответ как у cancel_order"""
+        return self.submit('cancel', request)
+    def submit(self, kind: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Поставить запрос в пачку и дождаться его результата (вызывается из потоков)"""
+        if self.window <= 0:
+            return self.send_single(kind, request)
+        future = concurrent.futures.Future()
+        with self.lock:
+            leader = not self.pending[kind]
+            self.pending[kind].append((request, future))
+            idle = not self.in_flight[kind]
+        # Первый запрос отправляет пачку: сразу, если ничего не отправляется,
+        # иначе ждет окно, собирая запросы, пришедшие во время отправки
+        if leader:
+            if not idle:
+                time.sleep(self.window)
+            self.send_pending(kind)
+        return future.result()
+    def send_pending(self, kind: str):
+        """Отправить накопленные запросы"""
+        with self.lock:
+            batch, self.pending[kind] = self.pending[kind], []
+            self.in_flight[kind] += len(batch)
+        try:
+            self.flush(kind, batch)
+        finally:
+            with self.lock:
+                self.in_flight[kind] -= len(batch)
+    def flush(self, kind: str, batch: List[tuple]):
+        for i in range(0, len(batch), self.batch_size):
+            chunk = batch[i:i + self.batch_size]
+            try:
+                if len(chunk) == 1:
+                    results = [self.send_single(kind, chunk[0][0])]
+                else:
+                    results = self.send_batch(kind, [request for request, _ in chunk])
+                for (_, future), result in zip(chunk, results):
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in chunk:
+                    if not future.done():
+                        future.set_exception(e)
+    def cancel_many(self, requests: List[Dict[str, Any]]) -> List[Any]:
+        """Отменить сразу несколько ордеров пачками; результат каждого - ответ или исключение"""
+        results = []
+        for i in range(0, len(requests), self.batch_size):
+            chunk = requests[i:i + self.batch_size]
+            try:
+                if len(chunk) == 1:
+                    results.append(self.send_single('cancel', chunk[0]))
+                else:
+                    results.extend(self.send_batch('cancel', chunk))
+            except Exception as e:
+                results.extend([e] * len(chunk))
+        return results
+    def send_single(self, kind: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        method = self.session.place_order if kind == 'place' else self.session.cancel_order
+        return method(category="linear", **request)
+    def send_batch(self, kind: str, requests: List[Dict[str, Any]]) -> List[Any]:
+        """Пачка одним запросом; результат каждого ордера - ответ или исключение"""
+        method = self.session.place_batch_order if kind == 'place' else self.session.cancel_batch_order
+        response = method(category="linear", request=requests)
+        items = response['result']['list']
+        errors = (response.get('retExtInfo') or {}).get('list', [])
+        results = []
+        for index in range(len(requests)):
+            error = errors[index] if index < len(errors) else {'code': 0, 'msg': 'OK'}
+            if index >= len(items):
+                results.append(OrderRejectedError("Нет результата в ответе пачки", -1))
+            elif error.get('code', 0) != 0:
+                results.append(OrderRejectedError(error.get('msg', ''), error['code']))
+            else:
+                results.append({'retCode': 0, 'retMsg': 'OK', 'result': items[index]})
+        return results
+class StateStore:
+    """Состояние активов и история сделок в SQLite (WAL), переживает перезапуск"""
+    def __init__(self, path: str, history_size: int = 1000):
+        self.path = path
+        self.history_size = history_size
+        self.trades_written = 0
+        self.lock = threading.Lock()  # Пишут и event loop, и потоки trade_asset
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL: запись не блокирует чтение, NORMAL не ждет fsync на каждую транзакцию
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS assets ("
+            "symbol TEXT PRIMARY KEY, reference_price REAL, last_update REAL, active_order TEXT)"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS trades (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT)")
+    def save_asset(self, symbol: str, asset_data: Dict[str, Any]):
+        """Записать состояние одного актива"""
+        active_order = asset_data.get('active_order')
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO assets (symbol, reference_price, last_update, active_order) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(symbol) DO UPDATE SET reference_price = excluded.reference_price, "
+                "last_update = excluded.last_update, active_order = excluded.active_order",
+                (symbol, asset_data.get('reference_price', 0), asset_data.get('last_update', 0),
+                 json.dumps(active_order) if active_order else None)
+            )
+    def append_trade(self, trade: Dict[str, Any]):
+        """Дописать сделку в историю"""
+        with self.lock:
+            self.connection.execute("INSERT INTO trades (data) VALUES (?)", (json.dumps(trade),))
+            self.trades_written += 1
+            # Старые сделки удаляются раз в history_size записей, а не на каждой
+            if self.trades_written % self.history_size == 0:
+                self.connection.execute(
+                    "DELETE FROM trades WHERE id <= (SELECT MAX(id) FROM trades) - ?", (self.history_size,)
+                )
+    def load_assets(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT symbol, reference_price, last_update, active_order FROM assets"
+            ).fetchall()
+        return {
+            symbol: {
+                'reference_price': reference_price or 0,
+                'last_update': last_update or 0,
+                'active_order': json.loads(active_order) if active_order else None
+            } for symbol, reference_price, last_update, active_order in rows
+        }
+    def load_trades(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT data FROM trades ORDER BY id DESC LIMIT ?", (self.history_size,)
+            ).fetchall()
+        return [json.loads(data) for (data,) in reversed(rows)]
+    def close(self):
+        with self.lock:
+            self.connection.close()
+class BotConfig:
+    """Неизменяемая версия настроек: общие параметры и активы; изменение создает новую версию"""
+    # Допустимые диапазоны общих параметров (включительно)
+    SETTINGS = {
+        'buy_percent': (0.1, 100),
+        'sell_percent': (0.1, 100),
+        'price_offset': (0, 10),
+        'min_lot_usd': (0.1, 10000),
+        'reprice_threshold': (0, 100)
+    }
+    __slots__ = ('version', 'assets', 'overrides') + tuple(SETTINGS)
+    def __init__(self, settings: Dict[str, float], assets: Dict[str, Dict[str, Any]],
+                 overrides: Dict[str, Dict[str, Any]] = None, version: int = 1):
+        for field in self.SETTINGS:
+            object.__setattr__(self, field, float(settings[field]))
+        object.__setattr__(self, 'assets', self.freeze(assets))
+        # Правки активов из админки, сохраняются на диск
+        object.__setattr__(self, 'overrides', self.freeze(overrides or {}))
+        object.__setattr__(self, 'version', version)
+    def __setattr__(self, name: str, value):
+        raise AttributeError("BotConfig неизменяем, используйте update()/replace()")
+    @staticmethod
+    def freeze(assets: Dict[str, Dict[str, Any]]) -> MappingProxyType:
+        return MappingProxyType({symbol: MappingProxyType(dict(config)) for symbol, config in assets.items()})
+    @classmethod
+    def validate_settings(cls, settings: Dict[str, Any]) -> Dict[str, float]:
+        """Проверить общие параметры"""
+        validated = {}
+        for field, value in settings.items():
+            if field not in cls.SETTINGS:
+                raise ValueError(f"Неизвестный параметр {field}")
+            low, high = cls.SETTINGS[field]
+            value = float(value)
+            if not low <= value <= high:
+                raise ValueError(f"{field}={value} вне диапазона {low}..{high}")
+            validated[field] = value
+        return validated
+    @staticmethod
+    def validate_asset(config: Dict[str, Any]) -> Dict[str, Any]:
+        """Проверить настройки актива"""
+        config = strategy.normalize_asset_config(config)
+        for field in ('n_percent', 'k_percent'):
+            if not 0 < config[field] < 100:
+                raise ValueError(f"{field}={config[field]} вне диапазона 0..100")
+        if config['max_position'] < 0:
+            raise ValueError(f"max_position={config['max_position']} меньше нуля")
+        return config
+    def settings(self) -> Dict[str, float]:
+        return {field: getattr(self, field) for field in self.SETTINGS}
+    def replace(self, settings: Dict[str, Any] = None, assets: Dict[str, Dict[str, Any]] = None,
+                overrides: Dict[str, Dict[str, Any]] = None) -> 'BotConfig':
+        """Новая версия с заменой частей без проверки"""
+        return BotConfig(
+            {**self.settings(), **(settings or {})},
+            self.assets if assets is None else assets,
+            self.overrides if overrides is None else overrides,
+            self.version + 1
+        )
+    def update(self, settings: Dict[str, Any] = None, assets: Dict[str, Dict[str, Any]] = None) -> 'BotConfig':
+        """Новая версия с проверенными изменениями параметров и активов (частичными)"""
+        changed_assets = {}
+        for symbol, changes in (assets or {}).items():
+            if symbol not in self.assets:
+                raise ValueError(f"Неизвестный символ {symbol}")
+            changed_assets[symbol] = self.validate_asset({**self.assets[symbol], **changes})
+        return self.replace(
+            self.validate_settings(settings or {}),
+            {**self.assets, **changed_assets},
+            {**self.overrides, **changed_assets}
+        )
+    def to_dict(self) -> Dict[str, Any]:
+        """Настройки для записи на диск: общие параметры и правки активов"""
+        return {
+            'version': self.version,
+            'settings': self.settings(),
+            'assets': {symbol: dict(config) for symbol, config in self.overrides.items()}
+        }
+class AssetRecord:
+    """Строка AssetStore: числовые поля читаются из столбцов, остальные хранятся в слотах"""
+    __slots__ = ('store', 'row', 'active_order', 'error_message', 'position_side')
+    OBJECT_FIELDS = ('active_order', 'error_message', 'position_side')
+    def __init__(self, store: 'AssetStore', row: int):
+        self.store = store
+        self.row = row
+        self.active_order = None
+        self.error_message = ''
+        self.position_side = ''
+    def __getitem__(self, key: str):
+        column = self.store.columns.get(key)
+        if column is not None:
+            if self.row < 0:
+                raise LookupError(f"Актив удален из AssetStore: {key}")
+            return float(column[self.row])
+        if key in self.OBJECT_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+    def __setitem__(self, key: str, value):
+        column = self.store.columns.get(key)
+        if column is not None:
+            if self.row < 0:
+                raise LookupError(f"Актив удален из AssetStore: {key}")
+            column[self.row] = value
+        elif key in self.OBJECT_FIELDS:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+    def __contains__(self, key: str) -> bool:
+        return key in self.store.columns or key in self.OBJECT_FIELDS
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    def update(self, values: Dict[str, Any]):
+        for key, value in values.items():
+            self[key] = value
+    def keys(self) -> List[str]:
+        return list(AssetStore.NUMERIC_FIELDS) + list(self.OBJECT_FIELDS)
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+class AssetStore:
+    """Состояние активов по столбцам: числовые поля в массивах NumPy по номеру символа"""
+    NUMERIC_FIELDS = (
+        'last_price', 'position', 'avg_price', 'reference_price', 'last_update',
+        'min_lot', 'max_lot', 'lot_size_step', 'qty_step', 'tick_size', 'min_notional', 'max_order_qty',
+        'buy_price_level', 'sell_price_level', 'last_trade_time', 'daily_pnl', 'weekly_pnl'
+    )
+    def __init__(self, capacity: int = 32):
+        self.capacity = capacity
+        self.index = {}  # {symbol: номер строки}
+        self.symbols = []  # Символы по номерам строк
+        self.records = []  # AssetRecord по номерам строк
+        self.columns = {field: np.zeros(capacity) for field in self.NUMERIC_FIELDS}
+        self.lock = threading.RLock()  # Добавление, удаление и перенос строк; поля читаются и пишутся без блокировки
+    def __len__(self) -> int:
+        return len(self.symbols)
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.index
+    def __iter__(self):
+        return iter(list(self.symbols))
+    def __getitem__(self, symbol: str) -> AssetRecord:
+        return self.records[self.index[symbol]]
+    def __setitem__(self, symbol: str, values: Dict[str, Any]):
+        """Добавить актив или заменить все его поля"""
+        with self.lock:
+            if symbol not in self.index:
+                if len(self.symbols) == self.capacity:
+                    self.grow()
+                row = len(self.symbols)
+                self.index[symbol] = row
+                self.symbols.append(symbol)
+                self.records.append(AssetRecord(self, row))
+            self.records[self.index[symbol]].update(values)
+    def __delitem__(self, symbol: str):
+        """Удалить актив, переместив последнюю строку на его место"""
+        with self.lock:
+            row = self.index.pop(symbol)
+            # Запись удаленного актива больше не указывает на строку: обращение к ней - ошибка
+            self.records[row].row = -1
+            last = len(self.symbols) - 1
+            if row != last:
+                for column in self.columns.values():
+                    column[row] = column[last]
+                moved = self.records[last]
+                moved.row = row
+                self.records[row] = moved
+                self.symbols[row] = self.symbols[last]
+                self.index[self.symbols[row]] = row
+            for column in self.columns.values():
+                column[last] = 0
+            self.symbols.pop()
+            self.records.pop()
+    def grow(self):
+        """Удвоить емкость столбцов"""
+        with self.lock:
+            self.capacity *= 2
+            for field, column in self.columns.items():
+                grown = np.zeros(self.capacity)
+                grown[:len(column)] = column
+                self.columns[field] = grown
+    def column(self, field: str) -> np.ndarray:
+        """Значения поля для всех активов (представление без копирования)"""
+        return self.columns[field][:len(self.symbols)]
+    def keys(self) -> List[str]:
+        return list(self.symbols)
+    def values(self) -> List[AssetRecord]:
+        return list(self.records)
+    def items(self):
+        return list(zip(self.symbols, self.records))
+class BybitStream:
+    """WebSocket Bybit с пингом и автоматическим переподключением"""
+    def __init__(self, url: str, ping_interval: float = 20):
+        self.url = url
+        self.ping_interval = ping_interval
+        self.connected = False
+        self.connected_since = 0  # Время последнего подключения
+        self.websocket = None
+        self.reconnect_delay = 1
+        self.max_reconnect_delay = 30
+        self.on_connected = None  # Обработчик после подключения и переподключения
+    async def on_connect(self, websocket):
+        """Действия после подключения (авторизация, подписка)"""
+    def handle_message(self, message: str):
+        """Обработать сообщение потока"""
+    async def heartbeat(self, websocket):
+        """Пинг для удержания соединения"""
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await websocket.send(json.dumps({'op': 'ping'}))
+    async def run(self):
+        """Подключение с автоматическим переподключением и переподпиской"""
+        name = type(self).__name__
+        while True:
+            heartbeat_task = None
+            try:
+                async with websockets.connect(self.url, ping_interval=None) as websocket:
+                    self.websocket = websocket
+                    await self.on_connect(websocket)
+                    self.connected = True
+                    self.connected_since = time.time()
+                    self.reconnect_delay = 1
+                    logger.info(f"{name} подключен")
+                    if self.on_connected is not None:
+                        try:
+                            self.on_connected()
+                        except Exception as e:
+                            logger.error(f"Ошибка обработчика подключения {name}: {e}")
+                    heartbeat_task = asyncio.create_task(self.heartbeat(websocket))
+                    async for message in websocket:
+                        self.handle_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка {name}: {e}")
+            finally:
+                self.connected = False
+                self.websocket = None
+                if heartbeat_task:
+                    heartbeat_task.cancel()
+            logger.info(f"Переподключение {name} через {self.reconnect_delay} сек")
+            await asyncio.sleep(self.reconnect_delay)
+            self.reconnect_delay = min(self.reconnect_delay * 2, self.max_reconnect_delay)
+class TickerStream(BybitStream):
+    """Поток цен tickers.{symbol} через публичный WebSocket Bybit"""
+    def __init__(self, url: str, ping_interval: float = 20, subscribe_chunk: int = 10):
+        super().__init__(url, ping_interval)
+        self.subscribe_chunk = subscribe_chunk  # Топиков в одном запросе подписки
+        self.symbols = set()
+        self.prices = {}  # Последние цены {symbol: price}
+        self.updated = {}  # Время последнего обновления {symbol: time}
+        self.listeners = []  # Обработчики обновления цены (symbol, price)
+    def add_listener(self, listener: Callable[[str, float], None]):
+        """Добавить обработчик обновления цены"""
+        self.listeners.append(listener)
+    def get_price(self, symbol: str) -> float:
+        """Последняя цена из потока, 0 если потока нет"""
+        if not self.connected:
+            return 0
+        return self.prices.get(symbol, 0)
+    async def send_op(self, op: str, symbols):
+        """Отправить subscribe/unsubscribe частями"""
+        topics = [f"tickers.{symbol}" for symbol in sorted(symbols)]
+        for i in range(0, len(topics), self.subscribe_chunk):
+            await self.websocket.send(json.dumps({'op': op, 'args': topics[i:i + self.subscribe_chunk]}))
+    async def on_connect(self, websocket):
+        if self.symbols:
+            await self.send_op('subscribe', self.symbols)
+    async def set_symbols(self, symbols):
+        """Изменить набор символов, подписка обновляется на живом соединении"""
+        symbols = set(symbols)
+        added = symbols - self.symbols
+        removed = self.symbols - symbols
+        self.symbols = symbols
+        for symbol in removed:
+            self.prices.pop(symbol, None)
+            self.updated.pop(symbol, None)
+        if self.connected and self.websocket is not None:
+            try:
+                if removed:
+                    await self.send_op('unsubscribe', removed)
+                if added:
+                    await self.send_op('subscribe', added)
+            except Exception as e:
+                logger.error(f"Ошибка изменения подписки WebSocket: {e}")
+    def handle_message(self, message: str):
+        """Обработать сообщение потока"""
+        data = json.loads(message)
+        topic = data.get('topic', '')
+        if not topic.startswith('tickers.'):
+            if data.get('op') == 'subscribe' and not data.get('success', True):
+                logger.error(f"Ошибка подписки WebSocket: {data}")
+            return
+        ticker = data.get('data', {})
+        symbol = ticker.get('symbol') or topic.split('.', 1)[1]
+        # В delta-сообщениях lastPrice есть только при изменении
+        if symbol in self.symbols and ticker.get('lastPrice'):
+            price = float(ticker['lastPrice'])
+            self.prices[symbol] = price
+            self.updated[symbol] = time.time()
+            for listener in self.listeners:
+                try:
+                    listener(symbol, price)
+                except Exception as e:
+                    logger.error(f"[{symbol}] Ошибка обработчика цены: {e}")
+class PrivateStream(BybitStream):
+    """Приватный WebSocket Bybit: ордера, исполнения, позиции, кошелек"""
+    topics = ['order', 'execution', 'position', 'wallet']
+    def __init__(self, url: str, api_key: str, api_secret: str, ping_interval: float = 20):
+        super().__init__(url, ping_interval)
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.handlers = {}  # {topic: обработчик списка записей}
+    def on(self, topic: str, handler: Callable[[List[Dict[str, Any]]], None]):
+        """Назначить обработчик топика"""
+        self.handlers[topic] = handler
+    async def on_connect(self, websocket):
+        # Подпись: HMAC_SHA256("GET/realtime" + expires)
+        expires = int((time.time() + 10) * 1000)
+        signature = hmac.new(
+            self.api_secret.encode('utf-8'),
+            f"GET/realtime{expires}".encode('utf-8'),
+            hashlib.sha256
+        ).hexdigest()
+        await websocket.send(json.dumps({'op': 'auth', 'args': [self.api_key, expires, signature]}))
+        response = json.loads(await asyncio.wait_for(websocket.recv(), timeout=10))
+        if not response.get('success'):
+            raise ConnectionError(f"Ошибка авторизации приватного WebSocket: {response}")
+        await websocket.send(json.dumps({'op': 'subscribe', 'args': self.topics}))
+    def handle_message(self, message: str):
+        """Обработать сообщение потока"""
+        data = json.loads(message)
+        topic = data.get('topic', '')
+        handler = self.handlers.get(topic)
+        if handler is None:
+            if data.get('op') == 'subscribe' and not data.get('success', True):
+                logger.error(f"Ошибка подписки приватного WebSocket: {data}")
+            return
+        try:
+            handler(data.get('data', []))
+        except Exception as e:
+            logger.error(f"Ошибка обработки {topic}: {e}")
+class LevelCrossingIndex:
+    """Отсортированные ценовые уровни по символам для поиска пересечений"""
     def __init__(self):
+        self.levels = {}  # {symbol: [уровни по возрастанию]}
+        self.last_prices = {}  # {symbol: последняя цена}
+    def set_levels(self, symbol: str, levels: List[float]):
+        """Зарегистрировать уровни символа (нулевые уровни игнорируются)"""
+        self.levels[symbol] = sorted(level for level in levels if level > 0)
+    def remove(self, symbol: str):
+        """Удалить символ из индекса"""
+        self.levels.pop(symbol, None)
+        self.last_prices.pop(symbol, None)
+    def update(self, symbol: str, price: float) -> bool:
+        """Запомнить цену и вернуть True, если она пересекла хотя бы один уровень"""
+        last_price = self.last_prices.get(symbol)
+        self.last_prices[symbol] = price
+        levels = self.levels.get(symbol)
+        if last_price is None or not levels:
+            return False
+        # Разные позиции в отсортированном списке = между ценами есть уровень
+        return bisect.bisect_left(levels, last_price) != bisect.bisect_left(levels, price)
+class StatusHub:
+    """Рассылка статуса WebSocket клиентам: снимок при подключении, далее только изменения"""
+    def __init__(self, queue_size: int = 16):
+        self.queue_size = queue_size
+        self.clients = {}  # {websocket: очередь отправки}
+        self.last_status = None  # Последний разосланный статус
+        self.seq = 0  # Номер последнего сообщения
+    def register(self, websocket) -> asyncio.Queue:
+        """Добавить клиента"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.clients[websocket] = queue
+        return queue
+    def unregister(self, websocket):
+        """Удалить клиента"""
+        self.clients.pop(websocket, None)
+    def enqueue(self, websocket, message: str):
+        """Поставить сообщение в очередь клиента, медленный клиент отключается"""
+        queue = self.clients.get(websocket)
+        if queue is None:
+            return
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning("WebSocket клиент не успевает принимать данные, отключаем")
+            self.unregister(websocket)
+            asyncio.get_running_loop().create_task(websocket.close())
+    def send_snapshot(self, websocket, status: Dict[str, Any]):
+        """Отправить клиенту полный статус"""
+        # Снимок должен совпадать с базой следующей дельты
+        if self.last_status is None:
+            self.last_status = status
+        self.enqueue(websocket, json.dumps({'type': 'snapshot', 'seq': self.seq, 'status': self.last_status}))
+    @staticmethod
+    def compute_delta(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+        """Изменившиеся поля статуса и активов"""
+        delta = {}
+        for key, value in new.items():
+            if key in ('assets', 'timestamp'):
+                continue
+            if old.get(key) != value:
+                delta[key] = value
+        assets = {}
+        old_assets = old.get('assets', {})
+        for symbol, asset in new.get('assets', {}).items():
+            old_asset = old_assets.get(symbol)
+            if old_asset is None:
+                assets[symbol] = asset
+                continue
+            changed = {field: value for field, value in asset.items() if old_asset.get(field) != value}
+            if changed:
+                assets[symbol] = changed
+        if assets:
+            delta['assets'] = assets
+        removed = [symbol for symbol in old_assets if symbol not in new.get('assets', {})]
+        if removed:
+            delta['removed_assets'] = removed
+        return delta
+    def publish(self, status: Dict[str, Any]):
+        """Разослать изменения статуса всем клиентам"""
+        if self.last_status is None:
+            self.last_status = status
+            return
+        delta = self.compute_delta(self.last_status, status)
+        self.last_status = status
+        if not delta:
+            return
+        self.seq += 1
+        delta['timestamp'] = status.get('timestamp')
+        # Сериализуем один раз для всех клиентов
+        message = json.dumps({'type': 'delta', 'seq': self.seq, 'delta': delta})
+        for websocket in list(self.clients.keys()):
+            self.enqueue(websocket, message)
+    async def sender(self, websocket, queue: asyncio.Queue):
+        """Отправка сообщений из очереди клиента"""
+        while True:
+            message = await queue.get()
+            await websocket.send_text(message)
+class MultiAssetTradingBot:
+    def __init__(self, session=None):
         # Конфигурация API
         self.api_key = os.getenv('API_KEY')
         self.api_secret = os.getenv('API_SECRET')
         self.admin_password = os.getenv('ADMIN_PASSWORD', 'admin123')
-        if not self.api_key or not self.api_secret:
+        # Биржа: bybit или mock (локальная имитация из mock_exchange.py)
+        self.exchange = os.getenv('EXCHANGE', 'bybit')
+        if session is None and self.exchange != 'mock' and (not self.api_key or not self.api_secret):
             raise ValueError("Необходимо установить API_KEY и API_SECRET в .env файле")
-        # Подключение к Bybit
-        try:
-            self.session = HTTP(
-                testnet=False,
-                api_key=self.api_key,
-                api_secret=self.api_secret
-            )
-            logger.info("Подключение к Bybit установлено")
-        except Exception as e:
-            logger.error(f"Ошибка подключения к Bybit: {e}")
-            raise
-        # Конфигурация бота
-        self.buy_percent = 30  # Покупаем 30% от позиции
-        self.sell_percent = 35  # Продаем 35% от позиции
-        self.price_offset = 0.3  # Отступ 0.3% для limit ордеров
-        self.order_ttl = 2 * 3600  # 2 часа TTL ордера
-        self.min_lot_usd = 5.0  # Минимальный лот $5
+        # Подключение к бирже; session - любой объект с методами pybit HTTP
+        if session is not None:
+            self.session = session
+        elif self.exchange == 'mock':
+            self.session = None  # Создается после загрузки конфигурации активов
+        else:
+            try:
+                self.session = HTTP(
+                    testnet=False,
+                    api_key=self.api_key,
+                    api_secret=self.api_secret
+                )
+                logger.info("Подключение к Bybit установлено")
+            except Exception as e:
+                logger.error(f"Ошибка подключения к Bybit: {e}")
+                raise
+        # Конфигурация бота: общие параметры по умолчанию, действующие - в self.config
+        self.default_settings = {
+            'buy_percent': strategy.BUY_PERCENT,  # Покупаем 30% от позиции
+            'sell_percent': strategy.SELL_PERCENT,  # Продаем 35% от позиции
+            'price_offset': strategy.PRICE_OFFSET,  # Отступ 0.3% для limit ордеров
+            'min_lot_usd': strategy.MIN_LOT_USD,  # Минимальный лот $5
+            'reprice_threshold': float(os.getenv('REPRICE_THRESHOLD', 0))  # Перенос ордера при уходе цены на N% (0 - выкл)
+        }
+        self.order_ttl = strategy.ORDER_TTL  # 2 часа TTL ордера
+        # Настройки из админки: файл CONFIG_FILE, изменения применяются между циклами
+        self.config_file = os.getenv('CONFIG_FILE', 'bot_config.json')
+        self.pending_config_updates = []  # Проверенные изменения (settings, assets), ждущие замены
+        self.config_updated = asyncio.Event()  # Будит торговый цикл для применения изменений
+        self.cycle_interval = 60  # Пауза между циклами (сек)
+        self.max_concurrency = int(os.getenv('MAX_CONCURRENCY', 8))  # Одновременно обрабатываемых активов
+        self.requests_per_second = float(os.getenv('REQUESTS_PER_SECOND', 100))  # Все запросы к API (лимит Bybit на IP - 600 за 5 сек)
+        # Лимиты методов сверх RequestScheduler.ENDPOINT_LIMITS: "place_order=10,get_positions=50"
+        self.endpoint_limits = {
+            name.strip(): float(rate) for name, rate in
+            (item.split('=') for item in os.getenv('ENDPOINT_LIMITS', '').split(',') if '=' in item)
+        }
         # Состояние бота
         self.trading_active = False
-        self.assets_data = {}  # Данные по каждому активу
-        self.websocket_listeners = set()
+        self.assets_data = AssetStore()  # Данные по каждому активу
+        self.status_hub = StatusHub()
+        self.websocket_listeners = self.status_hub.clients
+        self.broadcast_interval = float(os.getenv('BROADCAST_INTERVAL', 0.5))  # Минимальный интервал рассылки статуса
+        self.state_version = 0  # Растет при каждом изменении состояния
+        self.status_epoch = int(time.time())  # Отличает версии статуса разных запусков
+        self.status_cache = None  # (версия, статус, JSON в байтах)
+        self.metrics = Metrics()
+        self.metrics.describe('bybit_request_seconds', 'histogram', 'Задержка запросов к API биржи по методам')
+        self.metrics.describe('bybit_errors_total', 'counter', 'Ошибки запросов к API биржи по методам и типам')
+        self.metrics.describe('bybit_rate_limit_remaining', 'gauge', 'Остаток лимита запросов из X-Bapi-Limit-Status')
+        self.metrics.describe('bybit_rate_limit', 'gauge', 'Лимит запросов из X-Bapi-Limit')
+        self.metrics.describe('trading_cycle_seconds', 'histogram', 'Длительность торгового цикла')
+        self.metrics.describe('cycle_selected_symbols', 'gauge', 'Активы с сигналом, переданные в trade_asset за цикл')
+        self.metrics.describe('asset_evaluation_seconds', 'histogram', 'Время оценки одного актива')
+        self.metrics.describe('order_ack_seconds', 'histogram', 'От отправки ордера до подтверждения (rest - ответ API, stream - приватный поток)')
+        self.metrics.describe('scheduler_tokens', 'gauge', 'Свободные токены лимитов запросов по методам')
+        self.metrics.describe('scheduler_wait_seconds', 'histogram', 'Ожидание лимита запросов по методам')
+        self.metrics.describe('scheduler_coalesced_total', 'counter', 'Чтения, объединенные с одинаковым запросом в полете')
+        self.metrics.describe('websocket_listeners', 'gauge', 'Подключенные клиенты /ws')
+        self.metrics.describe('stream_connected', 'gauge', 'Подключение WebSocket потоков биржи')
+        self.order_sent_time = {}  # Время отправки ордеров, ждущих подтверждения в приватном потоке
         self.trade_history = deque(maxlen=1000)  # История сделок
         self.account_balance = 0  # Баланс счета
         self.account_equity = 0   # Эквити счета
         self.account_available_margin = 0  # Доступная маржа
+        self.price_snapshot = {}  # Цены всех активов одним запросом {symbol: price}
+        self.price_snapshot_time = 0  # Время последнего снимка цен
+        self.position_snapshot = {}  # Позиции всех активов одним запросом {symbol: position_data}
+        self.position_snapshot_time = 0  # Время последнего снимка позиций
+        self.instruments = {}  # Фильтры инструментов {symbol: {...}}
+        self.instruments_time = 0  # Время загрузки фильтров инструментов
+        self.instruments_ttl = float(os.getenv('INSTRUMENTS_CACHE_TTL', 24 * 3600))
+        self.quantizers = {}  # Округление ордеров по фильтрам инструментов {symbol: strategy.Quantizer}
+        self.instruments_cache_file = os.getenv('INSTRUMENTS_CACHE_FILE', 'instruments_cache.json')
+        self.ticker_stream_enabled = os.getenv('TICKER_STREAM', '1') == '1'
+        self.ticker_stream = TickerStream(os.getenv('BYBIT_WS_PUBLIC_URL', 'wss://stream.bybit.com/v5/public/linear'))
+        self.ticker_stream.add_listener(self.on_price_update)
+        self.event_driven = os.getenv('EVENT_DRIVEN', '1') == '1'  # Оценка по пересечению уровней
+        self.idle_cycle_interval = float(os.getenv('IDLE_CYCLE_INTERVAL', 300))  # Пауза цикла при работе по событиям
+        self.crossing_index = LevelCrossingIndex()
+        self.trade_semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.evaluating = set()  # Символы, по которым идет оценка
+        self.reevaluate = set()  # Символы, пересекшие уровень во время оценки
+        self.balance_time = 0  # Время последнего обновления баланса
+        self.rearm_pending = set()  # Символы с исполненным ордером, ждущие обновления позиции
+        self.position_update_time = {}  # Время биржи (мс) последней позиции из приватного потока
+        self.private_stream = None
+        if os.getenv('PRIVATE_STREAM', '1') == '1':
+            self.private_stream = PrivateStream(
+                os.getenv('BYBIT_WS_PRIVATE_URL', 'wss://stream.bybit.com/v5/private'),
+                self.api_key or 'mock',
+                self.api_secret or 'mock'
+            )
+            self.private_stream.on('order', self.on_order_update)
+            self.private_stream.on('execution', self.on_execution)
+            self.private_stream.on('position', self.on_position_update)
+            self.private_stream.on('wallet', self.on_wallet_update)
+            self.private_stream.on_connected = self.on_private_stream_connected
+        self.private_stream_connects = 0
+        # Завершающие статусы ордеров, пришедшие раньше REST-ответа: {orderId: (статус, время)}
+        self.early_order_status = {}
+        self.early_order_status_ttl = 60
+        # order_sent_time и early_order_status меняют и обработчики потока, и рабочие потоки оценки
+        self.order_events_lock = threading.Lock()
+        # Список активов: файл ASSETS_CONFIG_FILE (JSON, YAML, CSV) перечитывается при изменении
+        self.assets_config_file = os.getenv('ASSETS_CONFIG_FILE')
+        self.assets_config_mtime = 0  # Время изменения прочитанного файла
+        self.base_assets_config = {}  # Активы из файла или по умолчанию
+        self.universe = {}  # Последний примененный список активов {symbol: настройки}
+        self.retiring = set()  # Убранные из списка активы, ждущие закрытия ордера и позиции
+        # Автоотбор linear USDT символов по обороту и объему за 24 часа
+        self.discover_enabled = os.getenv('AUTO_DISCOVER', '0') == '1'
+        self.discover_interval = float(os.getenv('DISCOVER_INTERVAL', 3600))
+        self.discover_min_turnover = float(os.getenv('DISCOVER_MIN_TURNOVER', 10000000))  # USDT за 24 часа
+        self.discover_min_volume = float(os.getenv('DISCOVER_MIN_VOLUME', 0))  # Монет за 24 часа
+        self.discover_max_symbols = int(os.getenv('DISCOVER_MAX_SYMBOLS', 500))
+        self.discover_position_usd = float(os.getenv('DISCOVER_MAX_POSITION_USD', 20))  # max_position новых символов в $
+        self.discover_defaults = {
+            'n_percent': float(os.getenv('DISCOVER_N_PERCENT', 5)),
+            'k_percent': float(os.getenv('DISCOVER_K_PERCENT', 5)),
+            'enabled': True
+        }
+        self.discovered = {}  # Символы автоотбора {symbol: настройки}
+        self.discover_time = 0  # Время последнего автоотбора
         # Загрузка конфигурации активов
         self.load_assets_config()
+        # Состояние прошлого запуска: цены отсчета, активные ордера, история сделок
+        self.state_store = None
+        state_db = os.getenv('STATE_DB', 'bot_state.db')
+        if state_db:
+            try:
+                self.state_store = StateStore(state_db, self.trade_history.maxlen)
+                self.restore_state()
+            except Exception as e:
+                logger.error(f"Ошибка открытия хранилища состояния {state_db}: {e}")
+                self.state_store = None
+        if self.session is None:
+            from mock_exchange import MockExchange
+            self.session = MockExchange.from_env(list(self.assets_config.keys()))
+            logger.info("Используется имитация биржи")
+        # Все запросы идут через планировщик лимитов, задержки и ошибки попадают в /metrics
+        self.scheduler = RequestScheduler(
+            InstrumentedSession(self.session, self.metrics),
+            self.metrics,
+            self.requests_per_second,
+            self.endpoint_limits
+        )
+        self.session = self.scheduler
+        # Ордера и отмены, созданные почти одновременно, уходят пачками
+        self.order_gateway = OrderGateway(
+            self.session,
+            float(os.getenv('ORDER_BATCH_WINDOW', 0.05)),
+            int(os.getenv('ORDER_BATCH_SIZE', 10))
+        )
+    @property
+    def assets_config(self) -> MappingProxyType:
+        """Настройки активов действующей версии (только чтение)"""
+        return self.config.assets
     def load_assets_config(self):
         """Загрузка конфигурации активов"""
         # Конфигурация активов
-        self.assets_config = {
-            'SENDUSDT': {'n_percent': 11, 'k_percent': 9, 'enabled': True, 'max_position': 30.0},
-            'AVAXUSDT': {'n_percent': 3, 'k_percent': 1, 'enabled': True, 'max_position': 1.0},
-            'HOMEUSDT': {'n_percent': 3, 'k_percent': 2, 'enabled': True, 'max_position': 390.0},
-            'XRPUSDT': {'n_percent': 11, 'k_percent': 9, 'enabled': True, 'max_position': 6.0},
-            'DOGEUSDT': {'n_percent': 3, 'k_percent': 1, 'enabled': True, 'max_position': 70.0},
-            'HYPEUSDT': {'n_percent': 3, 'k_percent': 2, 'enabled': True, 'max_position': 0.34},
-            'HIFIUSDT': {'n_percent': 3, 'k_percent': 2, 'enabled': False, 'max_position': 216.0},
-            'ALUUSDT': {'n_percent': 1, 'k_percent': 1, 'enabled': True, 'max_position': 270.0},
-            'SAROSUSDT': {'n_percent': 8, 'k_percent': 11, 'enabled': True, 'max_position': 42.0},
-            'MUSDT': {'n_percent': 4, 'k_percent': 3, 'enabled': True, 'max_position': 15.0},
-            'MYXUSDT': {'n_percent': 13, 'k_percent': 14, 'enabled': True, 'max_position': 12.0},
-            'OGUSDT': {'n_percent': 13, 'k_percent': 1, 'enabled': True, 'max_position': 1.2},
-            'ORDERUSDT': {'n_percent': 10, 'k_percent': 5, 'enabled': True, 'max_position': 108.0},
-            'OMNIUSDT': {'n_percent': 10, 'k_percent': 6, 'enabled': True, 'max_position': 5.0},
-            'CYBERUSDT': {'n_percent': 9, 'k_percent': 6, 'enabled': True, 'max_position': 9.0},
-            'IDEXUSDT': {'n_percent': 14, 'k_percent': 6, 'enabled': True, 'max_position': 180.0},
-            'API3USDT': {'n_percent': 13, 'k_percent': 2, 'enabled': True, 'max_position': 15.0},
-            'MAVUSDT': {'n_percent': 11, 'k_percent': 4, 'enabled': True, 'max_position': 200.0},
-            'REXUSDT': {'n_percent': 10, 'k_percent': 2, 'enabled': True, 'max_position': 330.0},
-            'CROUSDT': {'n_percent': 14, 'k_percent': 1, 'enabled': True, 'max_position': 55.0},
-            'DOLOUSDT': {'n_percent': 15, 'k_percent': 3, 'enabled': True, 'max_position': 80.0},
-            'SIRENUSDT': {'n_percent': 15, 'k_percent': 2, 'enabled': True, 'max_position': 160.0},
-        }
+        self.base_assets_config = copy.deepcopy(strategy.DEFAULT_ASSETS_CONFIG)
+        # Конфигурация из файла (например, результат optimize.py)
+        self.reload_assets_config()
+        self.universe = copy.deepcopy(self.base_assets_config)
+        self.config = BotConfig(self.default_settings, self.base_assets_config)
+        # Сохраненные настройки из админки поверх файла активов
+        self.load_config()
         # Инициализация данных по каждому активу
         for symbol in self.assets_config.keys():
-            self.assets_data[symbol] = {
-                'last_price': 0,
-                'position': 0,
-                'avg_price': 0,
-                'reference_price': 0,
-                'active_order': None,
-                'last_update': time.time(),
-                'error_message': '',
-                'min_lot': 0,
-                'max_lot': 0,
-                'lot_size_step': 0.1,
-                'buy_price_level': 0,
-                'sell_price_level': 0,
-                'last_trade_time': 0,
-                'daily_pnl': 0,
-                'weekly_pnl': 0
-            }
+            self.assets_data[symbol] = self.new_asset_data()
         logger.info(f"Загружено конфигураций для {len(self.assets_config)} активов")
+    def load_config(self):
+        """Загрузить сохраненную версию настроек с проверкой"""
+        if not self.config_file or not os.path.exists(self.config_file):
+            return
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            settings = BotConfig.validate_settings(saved.get('settings', {}))
+            overrides = {symbol: BotConfig.validate_asset(config) for symbol, config in saved.get('assets', {}).items()}
+            assets = {**self.config.assets, **{symbol: config for symbol, config in overrides.items() if symbol in self.config.assets}}
+            self.config = BotConfig({**self.config.settings(), **settings}, assets, overrides, int(saved.get('version', 0)) + 1)
+            logger.info(f"Настройки загружены из {self.config_file}: версия {self.config.version}, правок активов {len(overrides)}")
+        except Exception as e:
+            logger.error(f"Ошибка чтения настроек {self.config_file}: {e}")
+    def save_config(self):
+        """Записать действующую версию настроек на диск"""
+        if not self.config_file:
+            return
+        try:
+            tmp_file = self.config_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.config.to_dict(), f, indent=2)
+            os.replace(tmp_file, self.config_file)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения настроек: {e}")
+    def submit_config(self, settings: Dict[str, Any] = None, assets: Dict[str, Dict[str, Any]] = None):
+        """Проверить изменения и поставить их в очередь до границы цикла (ValueError при ошибке)"""
+        config = self.config
+        for queued_settings, queued_assets in self.pending_config_updates:
+            config = config.update(queued_settings, queued_assets)
+        config.update(settings, assets)
+        self.pending_config_updates.append((settings or {}, assets or {}))
+        self.config_updated.set()
+    def apply_pending_config(self) -> bool:
+        """Применить накопленные изменения одной заменой ссылки на версию настроек"""
+        if not self.pending_config_updates:
+            return False
+        updates, self.pending_config_updates = self.pending_config_updates, []
+        self.config_updated.clear()
+        config = self.config
+        for settings, assets in updates:
+            try:
+                config = config.update(settings, assets)
+            except ValueError as e:
+                # Символ мог пропасть из списка активов после проверки
+                logger.error(f"Изменение настроек отклонено: {e}")
+        if config is self.config:
+            return False
+        # Оценка активов читает self.config один раз и видит целую версию без блокировок
+        self.config = config
+        self.save_config()
+        self.mark_changed()
+        logger.info(f"Применены настройки версии {config.version}")
+        return True
+    def reload_assets_config(self) -> bool:
+        """Перечитать файл активов, если он изменился"""
+        if not self.assets_config_file or not os.path.exists(self.assets_config_file):
+            return False
+        try:
+            mtime = os.path.getmtime(self.assets_config_file)
+            if mtime == self.assets_config_mtime:
+                return False
+            # Ошибочный файл читается один раз, до следующего изменения
+            self.assets_config_mtime = mtime
+            self.base_assets_config = strategy.load_assets_file(self.assets_config_file)
+            logger.info(f"Конфигурация активов загружена из {self.assets_config_file}: {len(self.base_assets_config)} активов")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка чтения {self.assets_config_file}: {e}")
+            return False
+    def discover_assets(self) -> Dict[str, Dict[str, Any]]:
+        """Автоотбор linear USDT символов по обороту и объему за 24 часа одним запросом get_tickers"""
+        try:
+            if not self.instruments or time.time() - self.instruments_time > self.instruments_ttl:
+                if not self.load_instruments_cache():
+                    self.refresh_instruments()
+            response = self.session.get_tickers(category="linear")
+            candidates = []
+            for ticker in response['result']['list']:
+                symbol = ticker['symbol']
+                price = float(ticker.get('lastPrice') or 0)
+                turnover = float(ticker.get('turnover24h') or 0)
+                volume = float(ticker.get('volume24h') or 0)
+                if (symbol.endswith('USDT') and symbol in self.instruments and price > 0 and
+                        turnover >= self.discover_min_turnover and volume >= self.discover_min_volume):
+                    candidates.append((turnover, symbol, price))
+            candidates.sort(reverse=True)
+            discovered = {}
+            for turnover, symbol, price in candidates[:self.discover_max_symbols]:
+                # Символ, уже прошедший отбор, сохраняет свои настройки
+                if symbol in self.discovered:
+                    discovered[symbol] = self.discovered[symbol]
+                    continue
+                max_position = strategy.build_quantizer(self.instruments[symbol]).min_lot(self.discover_position_usd, price)
+                discovered[symbol] = {**self.discover_defaults, 'max_position': float(max_position)}
+            logger.info(f"Автоотбор: {len(discovered)} из {len(candidates)} символов с оборотом от {self.discover_min_turnover:.0f} USDT")
+            return discovered
+        except Exception as e:
+            logger.error(f"Ошибка автоотбора символов: {e}")
+            return None
+    def removable(self, symbol: str) -> bool:
+        """Актив можно убрать: нет ордера, позиции и идущей оценки"""
+        if symbol in self.evaluating:
+            return False
+        if symbol not in self.assets_data:
+            return True
+        asset_data = self.assets_data[symbol]
+        return not asset_data['active_order'] and not asset_data['position']
+    def load_universe(self) -> Dict[str, Dict[str, Any]]:
+        """Список активов из файла и автоотбора; None, если применять нечего"""
+        changed = self.reload_assets_config()
+        if self.discover_enabled and time.time() - self.discover_time > self.discover_interval:
+            self.discover_time = time.time()
+            discovered = self.discover_assets()
+            if discovered is not None and discovered != self.discovered:
+                self.discovered = discovered
+                changed = True
+        # Убранные активы, дождавшиеся закрытия ордера и позиции
+        if not changed and not any(self.removable(symbol) for symbol in list(self.retiring)):
+            return None
+        # Настройки из файла важнее автоотбора
+        return {**self.discovered, **self.base_assets_config}
+    def apply_universe(self, universe: Dict[str, Dict[str, Any]]) -> List[str]:
+        """Добавить, обновить и убрать активы по новому списку; возвращает добавленные"""
+        assets = dict(self.config.assets)
+        overrides = dict(self.config.overrides)
+        added = []
+        for symbol, config in universe.items():
+            previous = self.universe.get(symbol)
+            if previous is not None and previous != config:
+                # Правки из админки действуют, пока не изменится запись в файле
+                overrides.pop(symbol, None)
+            if symbol not in assets or previous != config:
+                assets[symbol] = overrides.get(symbol, config)
+            if symbol not in self.assets_data:
+                self.assets_data[symbol] = self.new_asset_data()
+                added.append(symbol)
+        removed = []
+        retiring = (set(self.universe) | self.retiring) - set(universe)
+        self.retiring = set()
+        for symbol in retiring:
+            if symbol not in assets:
+                continue
+            if not self.removable(symbol):
+                # С ордером или позицией актив только выключается и убирается позже
+                self.retiring.add(symbol)
+                if assets[symbol].get('enabled', False):
+                    assets[symbol] = {**assets[symbol], 'enabled': False}
+                    logger.warning(f"[{symbol}] Убран из списка активов, но есть ордер или позиция - торговля выключена")
+                continue
+            del assets[symbol]
+            overrides.pop(symbol, None)
+            if symbol in self.assets_data:
+                del self.assets_data[symbol]
+            self.crossing_index.remove(symbol)
+            self.quantizers.pop(symbol, None)
+            self.price_snapshot.pop(symbol, None)
+            self.position_snapshot.pop(symbol, None)
+            self.position_update_time.pop(symbol, None)
+            removed.append(symbol)
+        self.universe = copy.deepcopy(universe)
+        overrides_changed = overrides.keys() != self.config.overrides.keys()
+        self.config = self.config.replace(assets=assets, overrides=overrides)
+        if overrides_changed:
+            self.save_config()
+        self.mark_changed()
+        logger.info(f"Список активов обновлен: добавлено {len(added)}, убрано {len(removed)}, всего {len(assets)}")
+        return added
+    def prepare_assets(self, symbols: List[str]):
+        """Состояние, лоты и ордера новых активов"""
+        self.restore_assets(symbols)
+        self.initialize_asset_lots(symbols)
+        self.reconcile_orders(symbols)
+    async def refresh_universe(self):
+        """Применить изменения файла активов и автоотбора между циклами"""
+        # Диск и сеть - вне event loop, изменение списка - в нем, между оценками
+        universe = await asyncio.to_thread(self.load_universe)
+        if universe is not None:
+            added = self.apply_universe(universe)
+            if added:
+                await asyncio.to_thread(self.prepare_assets, added)
+    def restore_state(self):
+        """Восстановить состояние активов и историю сделок из хранилища"""
+        started = time.perf_counter()
+        restored = 0
+        for symbol, saved in self.state_store.load_assets().items():
+            if symbol in self.assets_data:
+                self.assets_data[symbol].update(saved)
+                restored += 1
+        self.trade_history.extend(self.state_store.load_trades())
+        logger.info(f"Состояние восстановлено: {restored} активов, {len(self.trade_history)} сделок "
+                    f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+    def restore_assets(self, symbols: List[str]):
+        """Восстановить сохраненное состояние добавленных активов"""
+        if self.state_store is None or not symbols:
+            return
+        saved = self.state_store.load_assets()
+        for symbol in symbols:
+            if symbol in saved and symbol in self.assets_data:
+                self.assets_data[symbol].update(saved[symbol])
+    def save_asset_state(self, symbol: str):
+        """Сохранить цену отсчета и активный ордер актива"""
+        if self.state_store is None:
+            return
+        try:
+            self.state_store.save_asset(symbol, self.assets_data[symbol])
+        except Exception as e:
+            logger.error(f"[{symbol}] Ошибка сохранения состояния: {e}")
+    def get_open_orders(self) -> List[Dict[str, Any]]:
+        """Все открытые linear ордера с пагинацией"""
+        orders = []
+        cursor = None
+        while True:
+            params = {'category': "linear", 'settleCoin': "USDT", 'limit': 50}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.session.get_open_orders(**params)
+            orders.extend(response['result']['list'])
+            cursor = response['result'].get('nextPageCursor')
+            if not cursor:
+                return orders
+    def reconcile_orders(self, symbols: List[str] = None):
+        """Восстановить активные ордера по открытым ордерам биржи и отменить дубли (по умолчанию - всех активов)"""
+        try:
+            fetched_at = time.time()
+            grouped = {}
+            for order in self.get_open_orders():
+                symbol = order.get('symbol')
+                # Ордера сетки - limit без условий (TP/SL и условные не трогаем)
+                if symbol in self.assets_data and order.get('orderType') == 'Limit' and not order.get('stopOrderType'):
+                    grouped.setdefault(symbol, []).append(order)
+            duplicates = []
+            for symbol in (self.assets_data.keys() if symbols is None else symbols):
+                if symbol not in self.assets_data or symbol in self.evaluating:
+                    # Идущая оценка сама ведет ордер актива, сверка с ней гонялась бы
+                    continue
+                data = self.assets_data[symbol]
+                orders = grouped.get(symbol, [])
+                active_order = data['active_order']
+                if active_order and active_order['timestamp'] >= fetched_at:
+                    # Ордер размещен после запроса - в списке биржи его еще нет
+                    continue
+                if not orders:
+                    if active_order:
+                        # Ордер исполнен или отменен, пока бот не работал
+                        logger.info(f"[{symbol}] Ордер {active_order['id']} больше не активен")
+                        data['active_order'] = None
+                        self.save_asset_state(symbol)
+                    continue
+                # Оставляем известный боту ордер, иначе самый новый
+                known_id = active_order['id'] if active_order else None
+                orders.sort(key=lambda order: (order.get('orderId') == known_id, int(order.get('createdTime') or 0)), reverse=True)
+                keep = orders[0]
+                if keep.get('orderId') != known_id:
+                    data['active_order'] = {
+                        'id': keep['orderId'],
+                        'timestamp': int(keep.get('createdTime') or time.time() * 1000) / 1000,
+                        'price': float(keep.get('price') or 0),
+                        'side': keep.get('side', ''),
+                        'qty': float(keep.get('qty') or 0),
+                        'filled_qty': float(keep.get('cumExecQty') or 0)
+                    }
+                    logger.info(f"[{symbol}] Восстановлен активный ордер {keep['orderId']} по бирже")
+                    self.save_asset_state(symbol)
+                for order in orders[1:]:
+                    duplicates.append({'symbol': symbol, 'orderId': order['orderId']})
+            # Лишние ордера отменяются пачками
+            if duplicates:
+                logger.warning(f"Найдено дублирующих ордеров: {len(duplicates)}, отменяем")
+                for request, result in zip(duplicates, self.order_gateway.cancel_many(duplicates)):
+                    if isinstance(result, Exception):
+                        logger.error(f"[{request['symbol']}] Ошибка отмены дубля {request['orderId']}: {result}")
+            self.mark_changed()
+        except Exception as e:
+            logger.error(f"Ошибка сверки ордеров: {e}")
+    def new_asset_data(self) -> Dict[str, Any]:
+        """Начальное состояние актива"""
+        return {
+            'last_price': 0,
+            'position': 0,
+            'avg_price': 0,
+            'reference_price': 0,
+            'active_order': None,
+            'last_update': time.time(),
+            'error_message': '',
+            'min_lot': 0,
+            'max_lot': 0,
+            'lot_size_step': 0.1,
+            'qty_step': 0.1,
+            'tick_size': 0.0001,
+            'min_notional': 0,
+            'max_order_qty': 0,
+            'buy_price_level': 0,
+            'sell_price_level': 0,
+            'last_trade_time': 0,
+            'daily_pnl': 0,
+            'weekly_pnl': 0
+        }
+    def parse_instrument(self, instrument: Dict[str, Any]) -> Dict[str, float]:
+        """Извлечь фильтры лота и цены из ответа get_instruments_info"""
+        lot_size_filter = instrument.get('lotSizeFilter', {})
+        price_filter = instrument.get('priceFilter', {})
+        return {
+            'min_order_qty': float(lot_size_filter.get('minOrderQty') or 0.1),
+            'qty_step': float(lot_size_filter.get('qtyStep') or lot_size_filter.get('minOrderQty') or 0.1),
+            'max_order_qty': float(lot_size_filter.get('maxOrderQty') or 0),
+            'min_notional': float(lot_size_filter.get('minNotionalValue') or 0),
+            'tick_size': float(price_filter.get('tickSize') or 0.0001)
+        }
+    def load_instruments_cache(self) -> bool:
+        """Загрузить фильтры инструментов из файла, если кэш не устарел"""
+        try:
+            if not os.path.exists(self.instruments_cache_file):
+                return False
+            with open(self.instruments_cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if time.time() - cache.get('timestamp', 0) > self.instruments_ttl:
+                logger.info("Кэш инструментов устарел")
+                return False
+            self.instruments = cache.get('instruments', {})
+            self.instruments_time = cache['timestamp']
+            logger.info(f"Загружен кэш инструментов: {len(self.instruments)}")
+            return bool(self.instruments)
+        except Exception as e:
+            logger.error(f"Ошибка чтения кэша инструментов: {e}")
+            return False
+    def save_instruments_cache(self):
+        """Сохранить фильтры инструментов в файл"""
+        try:
+            tmp_file = self.instruments_cache_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'timestamp': self.instruments_time, 'instruments': self.instruments}, f)
+            os.replace(tmp_file, self.instruments_cache_file)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения кэша инструментов: {e}")
+    def refresh_instruments(self) -> bool:
+        """Получить фильтры всех linear инструментов одним запросом с пагинацией"""
+        try:
+            instruments = {}
+            cursor = ""
+            while True:
+                response = self.session.get_instruments_info(
+                    category="linear",
+                    limit=1000,
+                    cursor=cursor
+                )
+                for instrument in response['result']['list']:
+                    instruments[instrument['symbol']] = self.parse_instrument(instrument)
+                cursor = response['result'].get('nextPageCursor', '')
+                if not cursor:
+                    break
+            self.instruments = instruments
+            self.instruments_time = time.time()
+            self.save_instruments_cache()
+            logger.info(f"Загружены фильтры {len(instruments)} инструментов")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка получения информации об инструментах: {e}")
+            return False
+    def get_instrument(self, symbol: str) -> Dict[str, float]:
+        """Фильтры инструмента из кэша (память, файл, затем API)"""
+        if not self.instruments or time.time() - self.instruments_time > self.instruments_ttl:
+            if not self.load_instruments_cache():
+                self.refresh_instruments()
+        instrument = self.instruments.get(symbol)
+        if instrument is None:
+            # Новый символ, которого нет в кэше
+            response = self.session.get_instruments_info(category="linear", symbol=symbol)
+            if response['result']['list']:
+                instrument = self.parse_instrument(response['result']['list'][0])
+                self.instruments[symbol] = instrument
+                self.save_instruments_cache()
+        return instrument
     def calculate_asset_lots(self, symbol: str) -> Dict[str, float]:
         """Рассчитать минимальный и максимальный лот для актива"""
         try:
             # Получаем информацию об инструменте
-            response = self.session.get_instruments_info(
-                category="linear",
-                symbol=symbol
-            )
-            if response['result']['list']:
-                instrument = response['result']['list'][0]
+            instrument = self.get_instrument(symbol)
+            if instrument:
                 # Получаем минимальный шаг лота
-                lot_size_filter = instrument.get('lotSizeFilter', {})
-                lot_size_step = float(lot_size_filter.get('minOrderQty', 0.1))
+                lot_size_step = instrument['min_order_qty']
                 # Получаем текущую цену
-                current_price = self.get_asset_price(symbol)
+                current_price = self.get_cached_price(symbol)
                 if current_price <= 0:
                     current_price = 1.0
-                # Рассчитываем минимальный лот ($5)
-                min_lot = max(self.min_lot_usd / current_price, lot_size_step)
-                # Округляем до шага лота
-                min_lot = round(min_lot / lot_size_step) * lot_size_step
+                # Округление ордеров по фильтрам инструмента, считается один раз
+                quantizer = strategy.build_quantizer(instrument)
+                self.quantizers[symbol] = quantizer
+                # Минимальный лот ($5 и не меньше minNotionalValue) вверх до шага лота
+                min_lot_qty = quantizer.min_lot(self.config.min_lot_usd, current_price)
+                min_lot = float(min_lot_qty)
                 # Максимальный лот = минимальный * 3
-                max_lot = min_lot * 3
+                max_lot = float(min_lot_qty * 3)
                 logger.info(f"[{symbol}] min_lot=${min_lot*current_price:.2f} ({min_lot}), max_lot=${max_lot*current_price:.2f} ({max_lot})")
                 return {
                     'min_lot': min_lot,
                     'max_lot': max_lot,
                     'lot_size_step': lot_size_step,
-                    'current_price': current_price
+                    'current_price': current_price,
+                    **instrument
                 }
+            logger.warning(f"[{symbol}] Инструмент не найден")
         except Exception as e:
             logger.error(f"Ошибка расчета лотов для {symbol}: {e}")
-            return {
-                'min_lot': 0.1,
-                'max_lot': 0.3,
-                'lot_size_step': 0.1,
-                'current_price': 1.0
-            }
-    def initialize_asset_lots(self):
-        """Инициализировать лоты для всех активов"""
+        return {
+            'min_lot': 0.1,
+            'max_lot': 0.3,
+            'lot_size_step': 0.1,
+            'current_price': 1.0
+        }
+    def get_quantizer(self, symbol: str) -> strategy.Quantizer:
+        """Квантователь актива; до загрузки фильтров - по шагам из состояния актива"""
+        quantizer = self.quantizers.get(symbol)
+        if quantizer is None:
+            asset_data = self.assets_data[symbol]
+            quantizer = strategy.Quantizer(
+                asset_data['qty_step'] or 0.1,
+                asset_data['tick_size'] or 0.0001,
+                asset_data['lot_size_step'],
+                asset_data['max_order_qty'],
+                asset_data['min_notional']
+            )
+            self.quantizers[symbol] = quantizer
+        return quantizer
+    def initialize_asset_lots(self, symbols: List[str] = None):
+        """Инициализировать лоты для всех активов или только для symbols"""
         logger.info("Инициализация лотов для всех активов...")
-        for symbol in self.assets_config.keys():
+        self.refresh_price_snapshot()
+        for symbol in (symbols if symbols is not None else list(self.assets_config.keys())):
             lots = self.calculate_asset_lots(symbol)
-            self.assets_data[symbol]['min_lot'] = round(lots['min_lot'], 1)
-            self.assets_data[symbol]['max_lot'] = round(lots['max_lot'], 1)
+            self.assets_data[symbol]['min_lot'] = lots['min_lot']
+            self.assets_data[symbol]['max_lot'] = lots['max_lot']
             self.assets_data[symbol]['lot_size_step'] = lots['lot_size_step']
             self.assets_data[symbol]['last_price'] = lots['current_price']
+            for field in ('qty_step', 'tick_size', 'min_notional', 'max_order_qty'):
+                if field in lots:
+                    self.assets_data[symbol][field] = lots[field]
+        self.mark_changed()
         logger.info("Инициализация лотов завершена")
+    def refresh_price_snapshot(self) -> bool:
+        """Получить цены всех активов одним запросом get_tickers"""
+        try:
+            response = self.session.get_tickers(category="linear")
+            snapshot = {}
+            for ticker in response['result']['list']:
+                symbol = ticker.get('symbol')
+                if symbol in self.assets_config and ticker.get('lastPrice'):
+                    snapshot[symbol] = float(ticker['lastPrice'])
+            # Заменяем снимок целиком, чтобы все цены были на один момент
+            self.price_snapshot = snapshot
+            self.price_snapshot_time = time.time()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка получения снимка цен: {e}")
+            return False
+    def on_price_update(self, symbol: str, price: float):
+        """Обновление цены из WebSocket потока"""
+        if symbol in self.assets_data:
+            self.assets_data[symbol]['last_price'] = price
+            self.mark_changed()
+        # Пересечение уровня запускает оценку актива
+        if self.event_driven and self.trading_active and self.crossing_index.update(symbol, price):
+            if symbol not in self.evaluating:
+                logger.info("[%s] Пересечение уровня по цене %s", symbol, price)
+                self.schedule_evaluation(symbol)
+            else:
+                # Идущая оценка могла взять цену до пересечения - повторим после нее
+                self.reevaluate.add(symbol)
+    def schedule_evaluation(self, symbol: str):
+        """Запустить оценку актива из обработчика потока"""
+        if self.trading_active and symbol not in self.evaluating and self.assets_config.get(symbol, {}).get('enabled', False):
+            asyncio.get_running_loop().create_task(self.trade_asset_async(symbol))
+    def on_order_update(self, orders: List[Dict[str, Any]]):
+        """Обновление ордеров из приватного потока"""
+        for order in orders:
+            symbol = order.get('symbol')
+            if symbol not in self.assets_data or order.get('category', 'linear') != 'linear':
+                continue
+            status = order.get('orderStatus', '')
+            with self.order_events_lock:
+                # Первое событие по ордеру - подтверждение биржей
+                sent_time = self.order_sent_time.pop(order.get('orderId'), None)
+                active_order = self.assets_data[symbol]['active_order']
+                unknown = not active_order or active_order['id'] != order.get('orderId')
+                if unknown and status in ('Filled', 'Cancelled', 'Rejected', 'Deactivated', 'PartiallyFilledCanceled') and order.get('orderId'):
+                    # Ордер мог завершиться до ответа REST - place_limit_order проверит статус
+                    self.remember_early_status(order['orderId'], status)
+            if sent_time is not None and status == 'New':
+                self.metrics.observe('order_ack_seconds', time.monotonic() - sent_time, {'source': 'stream'})
+            if unknown:
+                continue
+            if status in ('Filled', 'Cancelled', 'Rejected', 'Deactivated', 'PartiallyFilledCanceled'):
+                self.assets_data[symbol]['active_order'] = None
+                logger.info("[%s] Ордер %s завершен: %s", symbol, order['orderId'], status)
+                if status in ('Filled', 'PartiallyFilledCanceled'):
+                    # Топики потока не упорядочены: позиция с этим исполнением могла прийти раньше ордера
+                    fill_time = int(order.get('updatedTime') or 0)
+                    if fill_time and self.position_update_time.get(symbol, 0) >= fill_time:
+                        self.schedule_evaluation(symbol)
+                    else:
+                        # Пересчитаем сетку после обновления позиции
+                        self.rearm_pending.add(symbol)
+            elif status == 'PartiallyFilled':
+                active_order['filled_qty'] = float(order.get('cumExecQty') or 0)
+            self.save_asset_state(symbol)
+            self.mark_changed()
+    def remember_early_status(self, order_id: str, status: str):
+        """Запомнить завершение неизвестного ордера, устаревшие записи удаляются (под order_events_lock)"""
+        now = time.monotonic()
+        for stale_id in [key for key, (_, seen) in self.early_order_status.items() if now - seen > self.early_order_status_ttl]:
+            del self.early_order_status[stale_id]
+        self.early_order_status[order_id] = (status, now)
+    def on_private_stream_connected(self):
+        """После переподключения приватного потока сверяем ордера: события за разрыв потеряны"""
+        self.private_stream_connects += 1
+        if self.private_stream_connects > 1 and self.trading_active:
+            logger.info("Приватный поток переподключен, сверка ордеров")
+            asyncio.get_running_loop().create_task(asyncio.to_thread(self.reconcile_orders))
+    def on_execution(self, executions: List[Dict[str, Any]]):
+        """Исполнения из приватного потока записываются в историю сделок"""
+        for execution in executions:
+            symbol = execution.get('symbol')
+            if execution.get('execType', 'Trade') != 'Trade' or execution.get('category', 'linear') != 'linear':
+                continue
+            trade = {
+                'symbol': symbol,
+                'side': execution.get('side', ''),
+                'price': float(execution.get('execPrice') or 0),
+                'qty': float(execution.get('execQty') or 0),
+                'fee': float(execution.get('execFee') or 0),
+                'order_id': execution.get('orderId', ''),
+                'exec_id': execution.get('execId', ''),
+                'timestamp': int(execution.get('execTime') or time.time() * 1000) / 1000
+            }
+            self.trade_history.append(trade)
+            if self.state_store is not None:
+                try:
+                    self.state_store.append_trade(trade)
+                except Exception as e:
+                    logger.error(f"[{symbol}] Ошибка сохранения сделки: {e}")
+            self.mark_changed()
+            if symbol in self.assets_data:
+                self.assets_data[symbol]['last_trade_time'] = trade['timestamp']
+            logger.info("[%s] Исполнение %s %s по цене %s", symbol, trade['side'], trade['qty'], trade['price'])
+    def on_position_update(self, positions: List[Dict[str, Any]]):
+        """Обновление позиций из приватного потока"""
+        for pos_data in positions:
+            symbol = pos_data.get('symbol')
+            if symbol not in self.assets_data or pos_data.get('category', 'linear') != 'linear':
+                continue
+            position_data = self.parse_position(pos_data)
+            # В hedge-режиме пустая сторона не должна затирать открытую
+            current = self.position_snapshot.get(symbol)
+            if int(pos_data.get('positionIdx') or 0) != 0 and position_data['position'] == 0 and \
+                    current and current['position'] != 0 and current['side'] != position_data['side']:
+                continue
+            self.position_snapshot[symbol] = position_data
+            self.apply_position(symbol, position_data)
+            self.position_update_time[symbol] = int(pos_data.get('updatedTime') or 0)
+            if symbol in self.rearm_pending:
+                self.rearm_pending.discard(symbol)
+                self.schedule_evaluation(symbol)
+    def on_wallet_update(self, wallets: List[Dict[str, Any]]):
+        """Обновление баланса из приватного потока"""
+        for wallet in wallets:
+            if wallet.get('accountType', 'UNIFIED') == 'UNIFIED':
+                self.apply_wallet(wallet)
+    def stream_symbols(self) -> List[str]:
+        """Символы для подписки на поток цен"""
+        return [symbol for symbol, config in self.assets_config.items() if config.get('enabled', False)]
+    def stream_covers(self, symbols: List[str]) -> bool:
+        """Поток цен подключен и уже знает цены всех символов"""
+        return self.ticker_stream.connected and all(symbol in self.ticker_stream.prices for symbol in symbols)
+    def get_cached_price(self, symbol: str) -> float:
+        """Цена актива из потока или снимка, с запросом по символу как запасной вариант"""
+        price = self.ticker_stream.get_price(symbol)
+        if price > 0:
+            return price
+        price = self.price_snapshot.get(symbol, 0)
+        if price > 0 and time.time() - self.price_snapshot_time < self.cycle_interval:
+            return price
+        return self.get_asset_price(symbol)
     def get_asset_price(self, symbol: str) -> float:
         """Получить текущую цену актива"""
         try:
@@ -180,68 +1751,160 @@ class MultiAssetTradingBot:
         try:
             response = self.session.get_wallet_balance(accountType="UNIFIED")
             if response['result']['list']:
-                wallet = response['result']['list'][0]
-                self.account_balance = float(wallet['totalWalletBalance']) if wallet['totalWalletBalance'] else 0
-                self.account_equity = float(wallet['totalEquity']) if wallet['totalEquity'] else 0
-                self.account_available_margin = float(wallet['totalAvailableBalance']) if wallet['totalAvailableBalance'] else 0
+                self.apply_wallet(response['result']['list'][0])
                 logger.info(f"Баланс: ${self.account_balance:.2f}, Эквити: ${self.account_equity:.2f}, Доступно: ${self.account_available_margin:.2f}")
         except Exception as e:
             logger.error(f"Ошибка получения баланса: {e}")
+    def apply_wallet(self, wallet: Dict[str, Any]):
+        """Записать баланс счета из ответа Bybit"""
+        self.account_balance = float(wallet['totalWalletBalance']) if wallet.get('totalWalletBalance') else 0
+        self.account_equity = float(wallet['totalEquity']) if wallet.get('totalEquity') else 0
+        self.account_available_margin = float(wallet['totalAvailableBalance']) if wallet.get('totalAvailableBalance') else 0
+        self.balance_time = time.time()
+        self.mark_changed()
+    def parse_position(self, pos_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Преобразовать позицию из ответа Bybit"""
+        position = float(pos_data['size']) if pos_data.get('size') else 0
+        position_side = pos_data.get('side', '')
+        # Корректируем знак позиции
+        if position_side == 'Sell' and position > 0:
+            position = -position
+        # В приватном потоке средняя цена приходит как entryPrice
+        avg_price = pos_data.get('avgPrice') or pos_data.get('entryPrice')
+        return {
+            'position': position,
+            'avg_price': float(avg_price) if avg_price else 0,
+            'pnl': float(pos_data['unrealisedPnl']) if pos_data.get('unrealisedPnl') else 0,
+            'side': position_side
+        }
     def get_asset_position(self, symbol: str) -> Dict[str, Any]:
         """Получить позицию по активу"""
         try:
             response = self.session.get_positions(category="linear", symbol=symbol)
             if response['result']['list']:
-                pos_data = response['result']['list'][0]
-                position = float(pos_data['size']) if pos_data['size'] else 0
-                position_side = pos_data.get('side', '')
-                # Корректируем знак позиции
-                if position_side == 'Sell' and position > 0:
-                    position = -position
-                return {
-                    'position': position,
-                    'avg_price': float(pos_data['avgPrice']) if pos_data['avgPrice'] else 0,
-                    'pnl': float(pos_data['unrealisedPnl']) if pos_data['unrealisedPnl'] else 0,
-                    'side': position_side
-                }
+                return self.parse_position(response['result']['list'][0])
             return {'position': 0, 'avg_price': 0, 'pnl': 0, 'side': ''}
         except Exception as e:
             logger.error(f"Ошибка получения позиции для {symbol}: {e}")
             return {'position': 0, 'avg_price': 0, 'pnl': 0, 'side': ''}
+    def refresh_position_snapshot(self) -> bool:
+        """Получить все USDT позиции одним запросом get_positions с пагинацией"""
+        try:
+            snapshot = {}
+            cursor = ""
+            while True:
+                response = self.session.get_positions(
+                    category="linear",
+                    settleCoin="USDT",
+                    limit=200,
+                    cursor=cursor
+                )
+                for pos_data in response['result']['list']:
+                    symbol = pos_data.get('symbol')
+                    if symbol not in self.assets_config:
+                        continue
+                    position = self.parse_position(pos_data)
+                    # В hedge-режиме по символу две записи, берем ненулевую
+                    if symbol not in snapshot or position['position'] != 0:
+                        snapshot[symbol] = position
+                cursor = response['result'].get('nextPageCursor', '')
+                if not cursor:
+                    break
+            # Символы без записи не имеют открытой позиции
+            for symbol in self.assets_config.keys():
+                snapshot.setdefault(symbol, {'position': 0, 'avg_price': 0, 'pnl': 0, 'side': ''})
+            self.position_snapshot = snapshot
+            self.position_snapshot_time = time.time()
+            # Обновляем позиции по всем активам, включая отключенные
+            for symbol, position_data in snapshot.items():
+                if symbol in self.assets_data:
+                    self.apply_position(symbol, position_data)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка получения снимка позиций: {e}")
+            return False
+    def get_cached_position(self, symbol: str) -> Dict[str, Any]:
+        """Позиция из снимка, с запросом по символу как запасной вариант"""
+        position_data = self.position_snapshot.get(symbol)
+        if position_data is not None and self.position_snapshot_fresh():
+            return position_data
+        return self.get_asset_position(symbol)
+    def position_snapshot_fresh(self) -> bool:
+        """Снимок позиций актуален: свежий или поддерживается приватным потоком"""
+        if self.private_stream_live(self.position_snapshot_time):
+            return True
+        return time.time() - self.position_snapshot_time < self.cycle_interval
+    def private_stream_live(self, snapshot_time: float) -> bool:
+        """Приватный поток подключен и снимок сделан после подключения"""
+        return self.private_stream is not None and self.private_stream.connected and \
+            snapshot_time >= self.private_stream.connected_since
+    def apply_position(self, symbol: str, position_data: Dict[str, Any]):
+        """Записать данные позиции в состояние актива"""
+        self.assets_data[symbol]['position'] = position_data['position']
+        self.assets_data[symbol]['avg_price'] = position_data['avg_price']
+        # Сохраняем PNL из полученных данных позиции
+        self.assets_data[symbol]['daily_pnl'] = position_data.get('pnl', 0)
+        self.assets_data[symbol]['weekly_pnl'] = position_data.get('pnl', 0)
+        self.assets_data[symbol]['position_side'] = position_data['side']
+        self.mark_changed()
     def place_limit_order(self, symbol: str, side: str, qty: float, price: float) -> str:
         """Разместить limit ордер"""
         try:
-            logger.info(f"[{symbol}] Попытка {side} ордера: {qty} по цене {price}")
-            # Округляем количество до шага лота (1 знак после запятой)
-            lot_size_step = self.assets_data[symbol].get('lot_size_step', 0.1)
-            qty = round(qty, 1)
-            qty = max(qty, lot_size_step)
+            logger.info("[%s] Попытка %s ордера: %s по цене %s", symbol, side, qty, price)
+            # Количество и цена в целых шагах фильтров инструмента, чтобы биржа не отклонила ордер
+            quantizer = self.get_quantizer(symbol)
+            position = self.assets_data[symbol]['position']
+            reduce_only = side == "Sell" and position > 0 or side == "Buy" and position < 0
+            order_price = quantizer.order_price(price, side)
+            order_qty = quantizer.order_qty(qty, float(order_price), reduce_only, position)
+            qty = float(order_qty)
+            price = float(order_price)
             # Определяем positionIdx для уменьшения позиции
             position_idx = 0  # По умолчанию
             position_side = self.assets_data[symbol].get('position_side', '')
-            order = self.session.place_order(
-                category="linear",
-                symbol=symbol,
-                side=side,
-                orderType="Limit",
-                qty=str(round(qty, 1)),
-                price=str(round(price, 4)),
-                timeInForce="GTC",
-                positionIdx=position_idx,
-                reduceOnly=side == "Sell" and self.assets_data[symbol]['position'] > 0 or
-                           side == "Buy" and self.assets_data[symbol]['position'] < 0
-            )
+            sent_time = time.monotonic()
+            order = self.order_gateway.place({
+                'symbol': symbol,
+                'side': side,
+                'orderType': "Limit",
+                'qty': quantizer.format(order_qty),
+                'price': quantizer.format(order_price),
+                'timeInForce': "GTC",
+                'positionIdx': position_idx,
+                'reduceOnly': reduce_only
+            })
             if 'result' in order and 'orderId' in order['result']:
                 order_id = order['result']['orderId']
-                logger.info(f"[{symbol}] Ордер {side} размещен: {order_id}")
-                # Сохраняем информацию об ордере
-                self.assets_data[symbol]['active_order'] = {
-                    'id': order_id,
-                    'timestamp': time.time(),
-                    'price': price,
-                    'side': side,
-                    'qty': qty
-                }
+                logger.info("[%s] Ордер %s размещен: %s", symbol, side, order_id)
+                self.metrics.observe('order_ack_seconds', time.monotonic() - sent_time, {'source': 'rest'})
+                # Проверка раннего завершения и запись ордера - атомарно относительно on_order_update
+                with self.order_events_lock:
+                    early = self.early_order_status.pop(order_id, None)
+                    if early is None:
+                        if self.private_stream is not None:
+                            self.order_sent_time[order_id] = sent_time
+                        self.assets_data[symbol]['active_order'] = {
+                            'id': order_id,
+                            'timestamp': time.time(),
+                            'price': price,
+                            'side': side,
+                            'qty': qty
+                        }
+                    else:
+                        self.assets_data[symbol]['active_order'] = None
+                if early is not None:
+                    # Поток сообщил о завершении раньше REST-ответа - ордер уже не активен
+                    status = early[0]
+                    logger.info("[%s] Ордер %s завершен до подтверждения: %s", symbol, order_id, status)
+                    if status in ('Filled', 'PartiallyFilledCanceled'):
+                        # Позиция могла обновиться раньше ответа - переоцениваем и после оценки
+                        self.rearm_pending.add(symbol)
+                        self.reevaluate.add(symbol)
+                    self.save_asset_state(symbol)
+                    self.mark_changed()
+                    return order_id
+                self.save_asset_state(symbol)
+                self.mark_changed()
                 return order_id
             else:
                 logger.error(f"[{symbol}] Ошибка размещения ордера {side}: {order}")
@@ -252,15 +1915,18 @@ class MultiAssetTradingBot:
     def cancel_order(self, symbol: str, order_id: str) -> bool:
         """Отменить ордер"""
         try:
-            logger.info(f"[{symbol}] Отмена ордера {order_id}")
-            response = self.session.cancel_order(
-                category="linear",
-                symbol=symbol,
-                orderId=order_id
-            )
-            logger.info(f"[{symbol}] Ордер {order_id} отменен")
+            logger.info("[%s] Отмена ордера %s", symbol, order_id)
+            response = self.order_gateway.cancel({
+                'symbol': symbol,
+                'orderId': order_id
+            })
+            logger.info("[%s] Ордер %s отменен", symbol, order_id)
+            with self.order_events_lock:
+                self.order_sent_time.pop(order_id, None)
             # Очищаем информацию об активном ордере
             self.assets_data[symbol]['active_order'] = None
+            self.save_asset_state(symbol)
+            self.mark_changed()
             return True
         except Exception as e:
             logger.error(f"[{symbol}] Ошибка отмены ордера {order_id}: {e}")
@@ -269,178 +1935,416 @@ class MultiAssetTradingBot:
         """Торговля одним активом"""
         if not self.trading_active:
             return
+        # Одна версия настроек на всю оценку: замена между циклами ее не затронет
+        bot_config = self.config
         # Проверяем, включен ли актив для торговли
-        if not self.assets_config.get(symbol, {}).get('enabled', False):
-            logger.info(f"[{symbol}] Отключен для торговли")
+        if not bot_config.assets.get(symbol, {}).get('enabled', False):
+            logger.info("[%s] Отключен для торговли", symbol, extra={'sampled': True})
             return
+        evaluation_start = time.perf_counter()
         try:
             # Получаем конфигурацию актива
-            config = self.assets_config.get(symbol)
+            config = bot_config.assets.get(symbol)
             if not config:
-                logger.warning(f"[{symbol}] Нет конфигурации")
+                logger.warning("[%s] Нет конфигурации", symbol, extra={'sampled': True})
                 return
             # Получаем текущую цену
-            current_price = self.get_asset_price(symbol)
+            current_price = self.get_cached_price(symbol)
             if current_price <= 0:
-                logger.warning(f"[{symbol}] Невозможно получить цену")
+                logger.warning("[%s] Невозможно получить цену", symbol, extra={'sampled': True})
                 return
             self.assets_data[symbol]['last_price'] = current_price
             # Получаем позицию
-            position_data = self.get_asset_position(symbol)
-            self.assets_data[symbol]['position'] = position_data['position']
-            self.assets_data[symbol]['avg_price'] = position_data['avg_price']
-            # Сохраняем PNL из полученных данных позиции
-            self.assets_data[symbol]['daily_pnl'] = position_data.get('pnl', 0)
-            self.assets_data[symbol]['weekly_pnl'] = position_data.get('pnl', 0)
-            self.assets_data[symbol]['position_side'] = position_data['side']
+            position_data = self.get_cached_position(symbol)
+            self.apply_position(symbol, position_data)
             # Устанавливаем цену отсчета если еще не установлена
             if self.assets_data[symbol]['reference_price'] == 0:
                 self.assets_data[symbol]['reference_price'] = current_price
-                logger.info(f"[{symbol}] Цена отсчета установлена: {current_price}")
+                self.save_asset_state(symbol)
+                logger.info("[%s] Цена отсчета установлена: %s", symbol, current_price)
             # Рассчитываем уровни покупки и продажи
-            buy_price_level = self.assets_data[symbol]['reference_price'] * (1 - config['k_percent'] / 100)
-            sell_price_level = self.assets_data[symbol]['avg_price'] * (1 + config['n_percent'] / 100) if self.assets_data[symbol]['avg_price'] > 0 else 0
+            buy_price_level, sell_price_level = strategy.price_levels(
+                self.assets_data[symbol]['reference_price'],
+                self.assets_data[symbol]['avg_price'],
+                config['k_percent'],
+                config['n_percent']
+            )
             self.assets_data[symbol]['buy_price_level'] = round(buy_price_level, 4)
             self.assets_data[symbol]['sell_price_level'] = round(sell_price_level, 4)
+            # Уровни для запуска оценки по событию
+            avg_buy_level = self.assets_data[symbol]['avg_price'] * (1 - config['k_percent'] / 100)
+            levels = [buy_price_level, avg_buy_level, sell_price_level] + self.reprice_levels(symbol, bot_config)
+            self.crossing_index.set_levels(symbol, levels)
             # Обновляем цену отсчета раз в 24 часа
-            if time.time() - self.assets_data[symbol]['last_update'] > 24 * 3600:
+            if time.time() - self.assets_data[symbol]['last_update'] > strategy.REFERENCE_RESET_INTERVAL:
                 self.assets_data[symbol]['reference_price'] = current_price
                 self.assets_data[symbol]['last_update'] = time.time()
-                logger.info(f"[{symbol}] Цена отсчета обновлена: {current_price}")
+                self.save_asset_state(symbol)
+                logger.info("[%s] Цена отсчета обновлена: %s", symbol, current_price)
+            # Решение по сетке: покупка 30% / продажа 35% от позиции
+            decision = strategy.decide_order(
+                current_price,
+                self.assets_data[symbol]['position'],
+                self.assets_data[symbol]['avg_price'],
+                buy_price_level,
+                sell_price_level,
+                self.assets_data[symbol]['min_lot'],
+                config['max_position'],
+                config['k_percent'],
+                bot_config.buy_percent,
+                bot_config.sell_percent,
+                bot_config.price_offset
+            )
             # Проверяем активный ордер
             if self.assets_data[symbol]['active_order']:
                 if time.time() - self.assets_data[symbol]['active_order']['timestamp'] > self.order_ttl:
                     # Отменяем просроченный ордер
                     self.cancel_order(symbol, self.assets_data[symbol]['active_order']['id'])
-                    logger.info(f"[{symbol}] Ордер отменен по истечении TTL")
+                    logger.info("[%s] Ордер отменен по истечении TTL", symbol)
                 else:
-                    logger.info(f"[{symbol}] Активный ордер ожидает исполнения")
+                    # Сигнал в ту же сторону - переносим цену ордера к рынку
+                    active_order = self.assets_data[symbol]['active_order']
+                    if decision and decision[0] == active_order['side']:
+                        self.reprice_order(symbol, decision[2], bot_config)
+                    logger.info("[%s] Активный ордер ожидает исполнения", symbol, extra={'sampled': True})
                     return
-            # Условия для покупки (30% от позиции, но не менее минимального лота)
-            buy_condition = (
-                    (self.assets_data[symbol]['position'] <= 0 or
-                     (self.assets_data[symbol]['avg_price'] > 0 and
-                      current_price < self.assets_data[symbol]['avg_price'] * (1 - config['k_percent'] / 100))) and
-                    current_price < buy_price_level
-            )
-            # Условия для продажи (уменьшение позиции на 35%)
-            sell_condition = (
-                    self.assets_data[symbol]['position'] > 0 and
-                    self.assets_data[symbol]['avg_price'] > 0 and
-                    current_price > sell_price_level
-            )
-            # Покупка (30% от позиции, но не менее минимального лота)
-            if buy_condition and abs(self.assets_data[symbol]['position']) <= config['max_position'] - self.assets_data[symbol]['min_lot']:
-                # Рассчитываем размер лота (30% от позиции)
-                position_size = abs(self.assets_data[symbol]['position'])
-                lot_size = position_size * (self.buy_percent / 100)
-                # Проверяем минимальный размер
-                min_lot = self.assets_data[symbol]['min_lot']
-                if lot_size < min_lot:
-                    lot_size = min_lot
-                # Рассчитываем цену с отступом
-                order_price = current_price * (1 - self.price_offset / 100)
+            if decision:
+                side, lot_size, order_price = decision
                 # Размещаем ордер
-                order_id = self.place_limit_order(symbol, "Buy", lot_size, order_price)
-                if order_id:
-                    logger.info(f"[{symbol}] Ордер на покупку размещен: {round(lot_size, 1)} по цене {round(order_price, 4)}")
-            # Продажа (уменьшение позиции на 35%)
-            elif sell_condition and abs(self.assets_data[symbol]['position']) >= self.assets_data[symbol]['min_lot']:
-                # Рассчитываем размер лота (35% от позиции)
-                position_size = abs(self.assets_data[symbol]['position'])
-                lot_size = position_size * (self.sell_percent / 100)
-                # Проверяем минимальный размер
-                min_lot = self.assets_data[symbol]['min_lot']
-                if lot_size < min_lot:
-                    lot_size = min_lot
-                # Если осталось мало - продаем всё
-                if position_size - lot_size < min_lot:
-                    lot_size = position_size
-                # Рассчитываем цену с отступом
-                order_price = current_price * (1 + self.price_offset / 100)
-                # Размещаем ордер на уменьшение позиции
-                order_id = self.place_limit_order(symbol, "Sell", lot_size, order_price)
+                order_id = self.place_limit_order(symbol, side, lot_size, order_price)
                 if order_id:
-                    logger.info(f"[{symbol}] Ордер на продажу размещен: {round(lot_size, 1)} по цене {round(order_price, 4)}")
+                    action = "покупку" if side == "Buy" else "продажу"
+                    logger.info("[%s] Ордер на %s размещен: %s по цене %s", symbol, action, lot_size, order_price)
         except Exception as e:
-            logger.error(f"[{symbol}] Ошибка торговли: {e}")
+            logger.error("[%s] Ошибка торговли: %s", symbol, e)
             self.assets_data[symbol]['error_message'] = str(e)
+        finally:
+            self.metrics.observe('asset_evaluation_seconds', time.perf_counter() - evaluation_start, {'symbol': symbol})
+            self.mark_changed()
+    def reprice_levels(self, symbol: str, config: BotConfig = None) -> List[float]:
+        """Цены рынка, при которых активный ордер уходит от целевой цены больше чем на reprice_threshold"""
+        config = config or self.config
+        active_order = self.assets_data[symbol]['active_order']
+        if config.reprice_threshold <= 0 or not active_order:
+            return []
+        # Целевая цена ордера - рынок с отступом price_offset
+        offset = 1 - config.price_offset / 100 if active_order['side'] == 'Buy' else 1 + config.price_offset / 100
+        return [
+            active_order['price'] * (1 + config.reprice_threshold / 100) / offset,
+            active_order['price'] * (1 - config.reprice_threshold / 100) / offset
+        ]
+    def reprice_order(self, symbol: str, price: float, config: BotConfig = None) -> bool:
+        """Перенести цену активного ордера через amend_order, сохраняя ордер"""
+        config = config or self.config
+        active_order = self.assets_data[symbol]['active_order']
+        if config.reprice_threshold <= 0 or not active_order or active_order['price'] <= 0:
+            return False
+        if abs(price - active_order['price']) / active_order['price'] * 100 <= config.reprice_threshold:
+            return False
+        try:
+            # Новая цена на шаге цены; количество растет, если стоимость упала ниже minNotionalValue (кроме reduceOnly)
+            quantizer = self.get_quantizer(symbol)
+            order_price = quantizer.order_price(price, active_order['side'])
+            if float(order_price) == active_order['price']:
+                return False
+            amend = {'price': quantizer.format(order_price)}
+            position = self.assets_data[symbol]['position']
+            reduce_only = active_order['side'] == "Sell" and position > 0 or active_order['side'] == "Buy" and position < 0
+            order_qty = quantizer.order_qty(active_order['qty'], float(order_price), reduce_only, position)
+            if float(order_qty) != active_order['qty']:
+                amend['qty'] = quantizer.format(order_qty)
+            self.session.amend_order(
+                category="linear",
+                symbol=symbol,
+                orderId=active_order['id'],
+                **amend
+            )
+            logger.info("[%s] Ордер %s перенесен: %s -> %s", symbol, active_order['id'], active_order['price'], float(order_price))
+            active_order['price'] = float(order_price)
+            active_order['qty'] = float(order_qty)
+            self.save_asset_state(symbol)
+            self.mark_changed()
+            return True
+        except Exception as e:
+            logger.error(f"[{symbol}] Ошибка переноса ордера {active_order['id']}: {e}")
+            return False
+    async def trade_asset_async(self, symbol: str):
+        """Торговля одним активом вне event loop с ограничением параллельности"""
+        # Не запускаем вторую оценку символа, пока идет первая
+        if symbol in self.evaluating:
+            return
+        self.evaluating.add(symbol)
+        try:
+            async with self.trade_semaphore:
+                logger.info("[%s] Торговля", symbol, extra={'sampled': True})
+                await asyncio.to_thread(self.trade_asset, symbol)
+        finally:
+            self.evaluating.discard(symbol)
+            # Уровень пересечен во время оценки - оцениваем еще раз по новой цене
+            if symbol in self.reevaluate:
+                self.reevaluate.discard(symbol)
+                self.schedule_evaluation(symbol)
+    def screen_symbols(self, symbols: List[str]) -> List[str]:
+        """Активы, которым нужна оценка trade_asset: сигнал, TTL ордера, цена отсчета или нет данных"""
+        if not symbols or not self.position_snapshot_fresh():
+            return symbols
+        try:
+            bot_config = self.config
+            store = self.assets_data
+            now = time.time()
+            snapshot_fresh = now - self.price_snapshot_time < self.cycle_interval
+            rows = np.array([store.index[symbol] for symbol in symbols])
+            prices = np.array([
+                self.ticker_stream.get_price(symbol) or (self.price_snapshot.get(symbol, 0) if snapshot_fresh else 0)
+                for symbol in symbols
+            ], dtype=float)
+            configs = [bot_config.assets[symbol] for symbol in symbols]
+            k_percent = np.array([config['k_percent'] for config in configs], dtype=float)
+            n_percent = np.array([config['n_percent'] for config in configs], dtype=float)
+            max_position = np.array([config['max_position'] for config in configs], dtype=float)
+            position = store.columns['position'][rows]
+            avg_price = store.columns['avg_price'][rows]
+            reference_price = store.columns['reference_price'][rows]
+            # Уровни как в strategy.price_levels, сразу для всех активов
+            buy_price_level = reference_price * (1 - k_percent / 100)
+            sell_price_level = np.where(avg_price > 0, avg_price * (1 + n_percent / 100), 0.0)
+            buy, sell, _, _ = strategy.decide_orders(
+                prices, position, avg_price, buy_price_level, sell_price_level,
+                store.columns['min_lot'][rows], max_position, k_percent,
+                bot_config.buy_percent, bot_config.sell_percent, bot_config.price_offset
+            )
+            # Без цены, без цены отсчета или к суточному сбросу - полная оценка
+            needs_evaluation = (
+                    (prices <= 0) | (reference_price == 0) |
+                    (now - store.columns['last_update'][rows] > strategy.REFERENCE_RESET_INTERVAL)
+            )
+            selected = []
+            quiet = []
+            for i, symbol in enumerate(symbols):
+                active_order = store.records[rows[i]].active_order
+                if active_order:
+                    # Истек TTL или сигнал в сторону ордера для переноса цены
+                    signal_side = 'Buy' if buy[i] else 'Sell' if sell[i] else ''
+                    fired = (now - active_order['timestamp'] > self.order_ttl or
+                             bot_config.reprice_threshold > 0 and signal_side == active_order['side'])
+                else:
+                    fired = buy[i] or sell[i]
+                if fired or needs_evaluation[i]:
+                    selected.append(symbol)
+                else:
+                    quiet.append(i)
+            # Остальным активам обновляем цену и уровни без вызова trade_asset
+            if quiet:
+                quiet_rows = rows[quiet]
+                store.columns['last_price'][quiet_rows] = prices[quiet]
+                store.columns['buy_price_level'][quiet_rows] = np.round(buy_price_level[quiet], 4)
+                store.columns['sell_price_level'][quiet_rows] = np.round(sell_price_level[quiet], 4)
+                avg_buy_level = avg_price * (1 - k_percent / 100)
+                for i in quiet:
+                    levels = [buy_price_level[i], avg_buy_level[i], sell_price_level[i]] + self.reprice_levels(symbols[i], bot_config)
+                    self.crossing_index.set_levels(symbols[i], levels)
+                self.mark_changed()
+            return selected
+        except Exception as e:
+            logger.error(f"Ошибка расчета сигналов: {e}")
+            return symbols
+    async def trading_cycle_once(self) -> List[str]:
+        """Один проход торгового цикла по всем включенным активам"""
+        logger.info("Выполнение торгового цикла")
+        cycle_start = time.monotonic()
+        # Изменения из админки, файла активов и автоотбора применяются между циклами
+        self.apply_pending_config()
+        await self.refresh_universe()
+        # Лимиты запросов соблюдает RequestScheduler внутри self.session
+        # Обновляем баланс счета, если его не ведет приватный поток
+        if not self.private_stream_live(self.balance_time):
+            await asyncio.to_thread(self.get_account_balance)
+        symbols = [symbol for symbol, config in self.assets_config.items() if config.get('enabled', False)]
+        if self.ticker_stream_enabled:
+            await self.ticker_stream.set_symbols(symbols)
+        # Снимок цен одним запросом, если поток не покрывает все активы
+        if not self.stream_covers(symbols):
+            await asyncio.to_thread(self.refresh_price_snapshot)
+        # Снимок всех позиций одним запросом, если его не ведет приватный поток
+        if not self.private_stream_live(self.position_snapshot_time):
+            await asyncio.to_thread(self.refresh_position_snapshot)
+        # Сигналы по всем активам одним проходом, торгуем только сработавшими
+        selected = self.screen_symbols(symbols)
+        self.metrics.set('cycle_selected_symbols', len(selected))
+        results = await asyncio.gather(
+            *(self.trade_asset_async(symbol) for symbol in selected),
+            return_exceptions=True
+        )
+        for symbol, result in zip(selected, results):
+            if isinstance(result, Exception):
+                logger.error(f"[{symbol}] Ошибка в задаче торговли: {result}")
+        cycle_duration = time.monotonic() - cycle_start
+        self.metrics.observe('trading_cycle_seconds', cycle_duration)
+        logger.info(f"Торговый цикл завершен за {cycle_duration:.2f} сек, оценено {len(selected)} из {len(symbols)}")
+        return symbols
     async def run_trading_cycle(self):
         """Запуск торгового цикла"""
         logger.info("Запуск торгового бота для множества активов")
+        # Автоотбор до инициализации лотов и сверки, чтобы она учла ордера отобранных символов
+        universe = await asyncio.to_thread(self.load_universe)
+        if universe is not None:
+            await asyncio.to_thread(self.restore_assets, self.apply_universe(universe))
         # Инициализируем лоты для всех активов
-        self.initialize_asset_lots()
+        await asyncio.to_thread(self.initialize_asset_lots)
+        # Активные ордера берутся с биржи: после перезапуска не ставим дубли поверх открытых
+        await asyncio.to_thread(self.reconcile_orders)
         while True:
             try:
                 if not self.trading_active:
                     logger.info("Торговля остановлена, ожидание...")
-                    await asyncio.sleep(30)
+                    self.apply_pending_config()
+                    await self.wait_next_cycle(30)
                     continue
-                logger.info("Выполнение торгового цикла")
-                # Обновляем баланс счета
-                self.get_account_balance()
-                # Торгуем каждым активом
-                for symbol in self.assets_config.keys():
-                    if self.assets_config[symbol].get('enabled', False):
-                        logger.info(f"[{symbol}] Торговля")
-                        self.trade_asset(symbol)
-                    await asyncio.sleep(1)  # Пауза между активами
-                logger.info("Торговый цикл завершен")
-                await asyncio.sleep(60)  # Пауза между циклами
+                symbols = await self.trading_cycle_once()
+                # При работе по событиям цикл нужен только для TTL и суточного сброса
+                if self.event_driven and self.stream_covers(symbols):
+                    await self.wait_next_cycle(self.idle_cycle_interval)
+                else:
+                    await self.wait_next_cycle(self.cycle_interval)  # Пауза между циклами
             except Exception as e:
                 logger.error(f"Критическая ошибка в основном цикле: {e}")
                 await asyncio.sleep(60)
+    async def wait_next_cycle(self, timeout: float):
+        """Пауза между циклами; изменение настроек начинает следующий цикл сразу"""
+        try:
+            await asyncio.wait_for(self.config_updated.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    async def broadcast_status(self):
+        """Рассылка изменений статуса подключенным клиентам"""
+        while True:
+            await asyncio.sleep(self.broadcast_interval)
+            try:
+                if self.websocket_listeners:
+                    # Статус пересобирается только после изменений
+                    status = self.get_status()
+                    if status is not self.status_hub.last_status:
+                        self.status_hub.publish(status)
+                else:
+                    # Без клиентов сравнивать не с чем, новый клиент получит снимок
+                    self.status_hub.last_status = None
+            except Exception as e:
+                logger.error(f"Ошибка рассылки статуса: {e}")
     def start_trading(self):
         """Запустить торговлю"""
         self.trading_active = True
+        self.mark_changed()
         logger.info("Торговля запущена")
     def stop_trading(self):
         """Остановить торговлю"""
         self.trading_active = False
+        self.mark_changed()
         logger.info("Торговля остановлена")
     def update_asset_config(self, symbol: str, config: Dict[str, Any]):
-        """Обновить конфигурацию актива"""
+        """Обновить конфигурацию актива (применится между циклами)"""
         if symbol in self.assets_config:
-            self.assets_config[symbol].update(config)
-            logger.info(f"[{symbol}] Конфигурация обновлена: {config}")
+            self.submit_config(assets={symbol: config})
+            logger.info(f"[{symbol}] Конфигурация принята: {config}")
             return True
         return False
+    def list_assets(self, offset: int = 0, limit: int = 50, search: str = '', enabled: bool = None) -> Dict[str, Any]:
+        """Страница списка активов для админ-панели с поиском по символу и фильтром включения"""
+        search = search.strip().upper()
+        assets_config = self.config.assets
+        symbols = sorted(
+            symbol for symbol, config in assets_config.items()
+            if search in symbol and (enabled is None or config.get('enabled', False) == enabled)
+        )
+        offset = max(0, offset)
+        limit = max(1, min(limit, 500))
+        assets = []
+        for symbol in symbols[offset:offset + limit]:
+            asset_data = self.assets_data[symbol] if symbol in self.assets_data else {}
+            assets.append({
+                'symbol': symbol,
+                'config': dict(assets_config[symbol]),
+                'last_price': asset_data.get('last_price', 0),
+                'min_lot': asset_data.get('min_lot', 0),
+                'position': asset_data.get('position', 0),
+                'discovered': symbol in self.discovered and symbol not in self.base_assets_config
+            })
+        return {'total': len(symbols), 'offset': offset, 'limit': limit, 'assets': assets}
+    def render_metrics(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        for name, tokens in self.scheduler.tokens().items():
+            self.metrics.set('scheduler_tokens', tokens, {'endpoint': name})
+        self.metrics.set('websocket_listeners', len(self.websocket_listeners))
+        self.metrics.set('stream_connected', int(self.ticker_stream.connected), {'stream': 'public'})
+        if self.private_stream is not None:
+            self.metrics.set('stream_connected', int(self.private_stream.connected), {'stream': 'private'})
+        return self.metrics.render()
+    def mark_changed(self):
+        """Отметить изменение состояния, кэш статуса будет пересобран"""
+        self.state_version += 1
+    def get_status_snapshot(self):
+        """Версия статуса, статус и его JSON; пересобираются только после изменений"""
+        cache = self.status_cache
+        if cache is not None and cache[0] == self.state_version:
+            return cache
+        # Версию берем до сборки: изменение во время сборки вызовет повторную сборку
+        version = self.state_version
+        status = self.build_status()
+        cache = (version, status, json.dumps(status).encode('utf-8'))
+        self.status_cache = cache
+        return cache
+    def get_status_etag(self, version: int) -> str:
+        """ETag для версии статуса"""
+        return f'"{self.status_epoch}-{version}"'
     def get_status(self) -> Dict[str, Any]:
-        """Получить статус всех активов"""
+        """Получить статус всех активов (кэшированный, не изменять)"""
+        return self.get_status_snapshot()[1]
+    def build_status(self) -> Dict[str, Any]:
+        """Собрать статус всех активов"""
+        config = self.config
         status = {
             'trading_active': self.trading_active,
             'assets': {},
             'timestamp': time.time(),
-            'buy_percent': self.buy_percent,
-            'sell_percent': self.sell_percent,
-            'price_offset': self.price_offset,
-            'min_lot_usd': self.min_lot_usd,
+            **config.settings(),
+            'config_version': config.version,
             'account_balance': round(self.account_balance, 2),
             'account_equity': round(self.account_equity, 2),
             'account_available_margin': round(self.account_available_margin, 2),
             'trade_history': list(self.trade_history)[-20:]  # Последние 20 сделок
         }
-        for symbol, data in self.assets_data.items():
-            config = self.assets_config.get(symbol, {})
+        # Числовые поля округляются по столбцам сразу для всех активов
+        store = self.assets_data
+        columns = {}
+        for field in ('last_price', 'avg_price', 'reference_price', 'min_lot', 'max_lot', 'buy_price_level', 'sell_price_level'):
+            column = store.column(field)
+            columns[field] = np.where(column > 0, np.round(column, 2), 0).tolist()
+        position = store.column('position')
+        columns['position'] = np.where(position != 0, np.round(position, 2), 0).tolist()
+        for field in ('daily_pnl', 'weekly_pnl'):
+            columns[field] = np.round(store.column(field), 2).tolist()
+        for field in ('last_update', 'lot_size_step'):
+            columns[field] = store.column(field).tolist()
+        for row, (symbol, data) in enumerate(store.items()):
+            asset_config = config.assets.get(symbol, {})
             status['assets'][symbol] = {
-                'last_price': round(data['last_price'], 2) if data['last_price'] > 0 else 0,
-                'position': round(data['position'], 2) if data['position'] != 0 else 0,
-                'avg_price': round(data['avg_price'], 2) if data['avg_price'] > 0 else 0,
-                'reference_price': round(data['reference_price'], 2) if data['reference_price'] > 0 else 0,
-                'active_order': data['active_order'],
-                'last_update': data['last_update'],
-                'error_message': data['error_message'],
-                'min_lot': round(data['min_lot'], 2) if data['min_lot'] > 0 else 0,
-                'max_lot': round(data['max_lot'], 2) if data['max_lot'] > 0 else 0,
-                'lot_size_step': data['lot_size_step'],
-                'buy_price_level': round(data['buy_price_level'], 2) if data['buy_price_level'] > 0 else 0,
-                'sell_price_level': round(data['sell_price_level'], 2) if data['sell_price_level'] > 0 else 0,
-                'enabled': config.get('enabled', True),
-                'n_percent': config.get('n_percent', 5),
-                'k_percent': config.get('k_percent', 5),
-                'max_position': config.get('max_position', 2.0),
-                'daily_pnl': round(data['daily_pnl'], 2),
-                'weekly_pnl': round(data['weekly_pnl'], 2)
+                'last_price': columns['last_price'][row],
+                'position': columns['position'][row],
+                'avg_price': columns['avg_price'][row],
+                'reference_price': columns['reference_price'][row],
+                'active_order': dict(data.active_order) if data.active_order else None,
+                'last_update': columns['last_update'][row],
+                'error_message': data.error_message,
+                'min_lot': columns['min_lot'][row],
+                'max_lot': columns['max_lot'][row],
+                'lot_size_step': columns['lot_size_step'][row],
+                'buy_price_level': columns['buy_price_level'][row],
+                'sell_price_level': columns['sell_price_level'][row],
+                'enabled': asset_config.get('enabled', True),
+                'n_percent': asset_config.get('n_percent', 5),
+                'k_percent': asset_config.get('k_percent', 5),
+                'max_position': asset_config.get('max_position', 2.0),
+                'daily_pnl': columns['daily_pnl'][row],
+                'weekly_pnl': columns['weekly_pnl'][row]
             }
         return status
 # Создаем экземпляр бота
@@ -448,7 +2352,8 @@ bot = MultiAssetTradingBot()
 # FastAPI приложение
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
+from fastapi import Request
 import uvicorn
 app = FastAPI(title="Multi-Asset Trading Bot")
 # Настройка CORS
@@ -796,6 +2701,17 @@ html = """
             background: #f8f9fa;
             border-radius: 4px;
         }
+        .assets-toolbar {
+            display: flex;
+            gap: 10px;
+            align-items: center;
+            margin: 10px 0;
+        }
+        .assets-toolbar input, .assets-toolbar select {
+            padding: 5px;
+            border: 1px solid #ddd;
+            border-radius: 4px;
+        }
         .asset-config-controls {
             display: flex;
             gap: 10px;
@@ -891,11 +2807,28 @@ html = """
                     <label for="minLotUsd">Минимальный лот ($):</label>
                     <input type="number" id="minLotUsd" step="1" min="1" max="100" value="5">
                 </div>
+                <div class="form-group">
+                    <label for="repriceThreshold">Перенос ордера при уходе цены (%, 0 - выкл):</label>
+                    <input type="number" id="repriceThreshold" step="0.1" min="0" max="10" value="0">
+                </div>
                 <div class="form-group" style="grid-column: 1 / -1;">
                     <h3>Конфигурация активов</h3>
+                    <div class="assets-toolbar">
+                        <input type="text" id="assetSearch" placeholder="Поиск символа" oninput="searchAssets()">
+                        <select id="assetEnabledFilter" onchange="loadAssetsPage(0)">
+                            <option value="">Все</option>
+                            <option value="true">Включенные</option>
+                            <option value="false">Выключенные</option>
+                        </select>
+                    </div>
                     <div id="assetsConfig">
                         <!-- Здесь будут динамически добавлены настройки активов -->
                     </div>
+                    <div class="assets-toolbar">
+                        <button class="btn-toggle" id="assetsPrev" onclick="loadAssetsPage(assetsOffset - assetsPageSize)">&larr;</button>
+                        <span id="assetsPageInfo"></span>
+                        <button class="btn-toggle" id="assetsNext" onclick="loadAssetsPage(assetsOffset + assetsPageSize)">&rarr;</button>
+                    </div>
                 </div>
                 <div class="form-actions">
                     <button class="btn-save" onclick="saveGlobalConfig()">СОХРАНИТЬ ОБЩИЕ НАСТРОЙКИ</button>
@@ -908,6 +2841,24 @@ html = """
         let reconnectAttempts = 0;
         const maxReconnectAttempts = 10;
         let chart = null;
+        let currentStatus = null;
+        let lastSeq = 0;
+        const assetsPageSize = 50;
+        let assetsOffset = 0;
+        let assetsSearchTimer = null;
+        function applyDelta(delta) {
+            for (const [key, value] of Object.entries(delta)) {
+                if (key === 'assets' || key === 'removed_assets') continue;
+                currentStatus[key] = value;
+            }
+            currentStatus.assets = currentStatus.assets || {};
+            for (const [symbol, fields] of Object.entries(delta.assets || {})) {
+                currentStatus.assets[symbol] = Object.assign(currentStatus.assets[symbol] || {}, fields);
+            }
+            for (const symbol of delta.removed_assets || []) {
+                delete currentStatus.assets[symbol];
+            }
+        }
         function connectWebSocket() {
             const wsUrl = `ws://${window.location.host}/ws`;
             console.log('Попытка подключения к WebSocket:', wsUrl);
@@ -922,8 +2873,21 @@ html = """
             ws.onmessage = function(event) {
                 try {
                     const data = JSON.parse(event.data);
-                    console.log('Получены данные:', data);
-                    renderStatus(data);
+                    if (data.type === 'snapshot') {
+                        currentStatus = data.status;
+                        lastSeq = data.seq;
+                    } else if (data.type === 'delta') {
+                        // Пропущено сообщение или нет снимка - запрашиваем полный статус
+                        if (!currentStatus || data.seq !== lastSeq + 1) {
+                            ws.send(JSON.stringify({type: 'resync'}));
+                            return;
+                        }
+                        applyDelta(data.delta);
+                        lastSeq = data.seq;
+                    } else {
+                        currentStatus = data;
+                    }
+                    renderStatus(currentStatus);
                 } catch (error) {
                     console.error('Ошибка обработки данных:', error);
                     document.getElementById('status').innerHTML = `
@@ -1083,15 +3047,45 @@ html = """
                     document.getElementById('sellPercent').value = data.sell_percent || 35;
                     document.getElementById('priceOffset').value = data.price_offset || 0.3;
                     document.getElementById('minLotUsd').value = data.min_lot_usd || 5;
-                    // Заполняем настройки активов
-                    const assetsConfigDiv = document.getElementById('assetsConfig');
+                    document.getElementById('repriceThreshold').value = data.reprice_threshold || 0;
+                    // Настройки активов загружаются по страницам
+                    return loadAssetsPage(0);
+                })
+                .then(() => {
+                    document.getElementById('adminModal').style.display = 'block';
+                })
+                .catch(error => {
+                    console.error('Ошибка загрузки настроек:', error);
+                    alert('Ошибка загрузки настроек: ' + error.message);
+                });
+        }
+        function searchAssets() {
+            // Запрос после паузы в наборе
+            clearTimeout(assetsSearchTimer);
+            assetsSearchTimer = setTimeout(() => loadAssetsPage(0), 300);
+        }
+        function loadAssetsPage(offset) {
+            const params = new URLSearchParams({
+                offset: Math.max(0, offset),
+                limit: assetsPageSize,
+                search: document.getElementById('assetSearch').value
+            });
+            const enabled = document.getElementById('assetEnabledFilter').value;
+            if (enabled) {
+                params.set('enabled', enabled);
+            }
+            return fetch('/api/assets?' + params)
+                .then(response => response.json())
+                .then(page => {
+                    assetsOffset = page.offset;
                     let assetsHtml = '';
-                    for (const [symbol, assetData] of Object.entries(data.assets || {})) {
-                        const config = data.assets_config ? data.assets_config[symbol] : {};
-                        const minLotUsd = assetData.min_lot && assetData.last_price ? (assetData.min_lot * assetData.last_price).toFixed(2) : '0.00';
+                    for (const asset of page.assets) {
+                        const symbol = asset.symbol;
+                        const config = asset.config;
+                        const minLotUsd = asset.min_lot && asset.last_price ? (asset.min_lot * asset.last_price).toFixed(2) : '0.00';
                         assetsHtml += `
                             <div class="asset-config-row" id="config-${symbol}">
-                                <div><strong>${symbol}</strong></div>
+                                <div><strong>${symbol}</strong>${asset.discovered ? ' <small>авто</small>' : ''}</div>
                                 <div class="asset-config-controls">
                                     <input type="number" class="asset-config-input" id="n_${symbol}" value="${config.n_percent || 5}" min="1" max="50" placeholder="n%">
                                     <input type="number" class="asset-config-input" id="k_${symbol}" value="${config.k_percent || 5}" min="1" max="50" placeholder="k%">
@@ -1107,12 +3101,12 @@ html = """
                             </div>
                         `;
                     }
-                    assetsConfigDiv.innerHTML = assetsHtml;
-                    document.getElementById('adminModal').style.display = 'block';
-                })
-                .catch(error => {
-                    console.error('Ошибка загрузки настроек:', error);
-                    alert('Ошибка загрузки настроек: ' + error.message);
+                    document.getElementById('assetsConfig').innerHTML = assetsHtml;
+                    const last = Math.min(page.offset + page.limit, page.total);
+                    document.getElementById('assetsPageInfo').textContent =
+                        page.total ? `${page.offset + 1}-${last} из ${page.total}` : 'Нет активов';
+                    document.getElementById('assetsPrev').disabled = page.offset <= 0;
+                    document.getElementById('assetsNext').disabled = last >= page.total;
                 });
         }
         function closeAdminPanel() {
@@ -1186,7 +3180,8 @@ html = """
                 buy_percent: parseInt(document.getElementById('buyPercent').value),
                 sell_percent: parseInt(document.getElementById('sellPercent').value),
                 price_offset: parseFloat(document.getElementById('priceOffset').value),
-                min_lot_usd: parseFloat(document.getElementById('minLotUsd').value)
+                min_lot_usd: parseFloat(document.getElementById('minLotUsd').value),
+                reprice_threshold: parseFloat(document.getElementById('repriceThreshold').value)
             };
             fetch('/api/config', {
                 method: 'POST',
@@ -1332,10 +3327,22 @@ html = """
 async def get():
     return HTMLResponse(html)
 @app.get("/api/status")
-async def get_status():
+async def get_status(request: Request):
     """Получить текущий статус через REST API"""
-    status = bot.get_status()
-    return status
+    version, status, body = bot.get_status_snapshot()
+    etag = bot.get_status_etag(version)
+    # Статус не изменился - клиенту достаточно 304
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={'ETag': etag})
+    return Response(content=body, media_type='application/json', headers={'ETag': etag})
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики для Prometheus"""
+    return Response(content=bot.render_metrics(), media_type='text/plain; version=0.0.4')
+@app.get("/api/assets")
+async def get_assets(offset: int = 0, limit: int = 50, search: str = '', enabled: bool = None):
+    """Список активов для админ-панели по страницам"""
+    return bot.list_assets(offset, limit, search, enabled)
 @app.post("/api/start")
 async def start_trading(data: PasswordCheck):
     """Запустить торговлю с проверкой пароля"""
@@ -1356,16 +3363,10 @@ async def stop_trading(data: PasswordCheck):
 async def update_config(config: ConfigUpdate):
     """Обновить конфигурацию"""
     try:
-        # Обновляем общие настройки
-        if config.buy_percent is not None:
-            bot.buy_percent = config.buy_percent
-        if config.sell_percent is not None:
-            bot.sell_percent = config.sell_percent
-        if config.price_offset is not None:
-            bot.price_offset = config.price_offset
-        if config.min_lot_usd is not None:
-            bot.min_lot_usd = config.min_lot_usd
-        logger.info("Конфигурация обновлена")
+        # Изменения проверяются сразу, а применяются новой версией настроек между циклами
+        settings = {field: value for field, value in config.dict().items() if value is not None}
+        bot.submit_config(settings=settings)
+        logger.info(f"Конфигурация принята: {settings}")
         return {"success": True, "message": "Конфигурация обновлена"}
     except Exception as e:
         logger.error(f"Ошибка обновления конфигурации: {e}")
@@ -1377,18 +3378,9 @@ async def update_asset_config(config: AssetConfigUpdate):
         symbol = config.symbol
         if not symbol:
             return {"success": False, "error": "Не указан символ"}
-        # Обновляем конфигурацию
-        asset_config = bot.assets_config.get(symbol, {})
-        if config.enabled is not None:
-            asset_config['enabled'] = config.enabled
-        if config.n_percent is not None:
-            asset_config['n_percent'] = config.n_percent
-        if config.k_percent is not None:
-            asset_config['k_percent'] = config.k_percent
-        if config.max_position is not None:
-            asset_config['max_position'] = config.max_position
-        bot.assets_config[symbol] = asset_config
-        logger.info(f"[{symbol}] Конфигурация обновлена: {config.dict()}")
+        changes = {field: value for field, value in config.dict().items() if field != 'symbol' and value is not None}
+        bot.submit_config(assets={symbol: changes})
+        logger.info(f"[{symbol}] Конфигурация принята: {changes}")
         return {"success": True}
     except Exception as e:
         logger.error(f"[{config.symbol}] Ошибка обновления конфигурации: {e}")
@@ -1404,28 +3396,47 @@ async def check_password(data: PasswordCheck):
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint для реал-тайм обновлений"""
     await websocket.accept()
-    bot.websocket_listeners.add(websocket)
+    queue = bot.status_hub.register(websocket)
+    sender_task = asyncio.create_task(bot.status_hub.sender(websocket, queue))
     try:
-        # Отправляем начальный статус
-        status = bot.get_status()
-        await websocket.send_json(status)
+        # Отправляем начальный статус, дальше рассылаются только изменения
+        bot.status_hub.send_snapshot(websocket, bot.get_status())
         print("Отправлены начальные данные клиенту")
-        # Держим соединение открытым
+        # Клиент может запросить полный статус
         while True:
-            await asyncio.sleep(1)
+            message = await websocket.receive_json()
+            if message.get('type') == 'resync':
+                bot.status_hub.send_snapshot(websocket, bot.get_status())
     except WebSocketDisconnect:
         print("Клиент WebSocket отключен")
-        bot.websocket_listeners.discard(websocket)
     except Exception as e:
         print(f"Ошибка WebSocket: {e}")
-        bot.websocket_listeners.discard(websocket)
+    finally:
+        sender_task.cancel()
+        bot.status_hub.unregister(websocket)
 # Запуск торгового цикла в фоне
 @app.on_event("startup")
 async def startup_event():
     """Запуск торгового цикла при старте приложения"""
     print("Запуск торгового цикла...")
+    # Имитация биржи: движение цен и локальные WebSocket
+    if bot.exchange == 'mock' and hasattr(bot.session, 'serve_websockets'):
+        _, public_url, private_url = await bot.session.serve_websockets()
+        bot.ticker_stream.url = public_url
+        if bot.private_stream is not None:
+            bot.private_stream.url = private_url
+        asyncio.create_task(bot.session.run(float(os.getenv('MOCK_TICK_INTERVAL', 1))))
     # Запускаем торговый цикл в фоновом режиме
     asyncio.create_task(bot.run_trading_cycle())
+    # Рассылка изменений статуса клиентам /ws
+    asyncio.create_task(bot.broadcast_status())
+    # Подписываемся на поток цен
+    if bot.ticker_stream_enabled:
+        await bot.ticker_stream.set_symbols(bot.stream_symbols())
+        asyncio.create_task(bot.ticker_stream.run())
+    # Подписываемся на ордера, исполнения, позиции и баланс
+    if bot.private_stream is not None:
+        asyncio.create_task(bot.private_stream.run())
 if __name__ == "__main__":
     print("MULTI-ASSET TRADING BOT - BYBIT")
     print("=" * 50)
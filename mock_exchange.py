@@ -0,0 +1,423 @@
+"""Локальная имитация Bybit для нагрузочных тестов и замеров задержек
+
+MockExchange повторяет методы pybit.unified_trading.HTTP, которые использует бот
+(тикеры, позиции, инструменты, баланс, размещение, изменение и отмена ордеров,
+в том числе пачками), ведет сопоставление limit ордеров и добавляет настраиваемые задержку и ошибки.
+serve_websockets() поднимает на localhost публичный и приватный WebSocket
+в формате Bybit v5, поэтому TickerStream и PrivateStream работают без изменений.
+
+Бот переключается на имитацию переменной окружения EXCHANGE=mock.
+"""
+import asyncio
+import collections
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+from typing import Dict, Any, List, Optional
+import websockets
+class MockExchangeError(Exception):
+    """Имитированная ошибка биржи (аналог InvalidRequestError из pybit)"""
+    def __init__(self, message: str, status_code: int = 10001):
+        super().__init__(f"{message} (ErrCode: {status_code})")
+        self.message = message
+        self.status_code = status_code
+class MockExchange:
+    """Биржа в памяти процесса с интерфейсом pybit HTTP"""
+    def __init__(self, symbols: List[str], start_price: float = 1.0, volatility: float = 0.001,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 balance: float = 10000.0, maker_fee: float = 0.0002, taker_fee: float = 0.00055,
+                 seed: Optional[int] = None, order_log_size: int = 10000):
+        self.random = random.Random(seed)
+        self.latency = latency  # Задержка ответа (сек)
+        self.jitter = jitter  # Случайная добавка к задержке (сек)
+        self.error_rate = error_rate  # Доля запросов, завершающихся ошибкой
+        self.volatility = volatility  # Стандартное отклонение шага цены
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.lock = threading.RLock()
+        self.prices = {symbol: start_price * (1 + self.random.uniform(-0.5, 0.5)) for symbol in symbols}
+        self.instruments = {
+            symbol: {
+                'symbol': symbol,
+                'status': 'Trading',
+                'contractType': 'LinearPerpetual',
+                'settleCoin': 'USDT',
+                'lotSizeFilter': {'minOrderQty': '0.1', 'qtyStep': '0.1', 'maxOrderQty': '1000000', 'minNotionalValue': '5'},
+                'priceFilter': {'tickSize': '0.0001'}
+            } for symbol in symbols
+        }
+        self.positions = {}  # {symbol: {'size': со знаком, 'avg_price': ...}}
+        self.orders = {}  # Активные ордера {orderId: order}
+        self.balance = balance
+        self.request_counts = {}  # {метод: количество вызовов}
+        # Последние принятые ордера (symbol, side, perf_counter при получении) для замера задержки решение-ордер
+        self.order_log = collections.deque(maxlen=order_log_size)
+        self.listeners = []  # Обработчики событий (topic, data) для приватного WebSocket
+        self.price_listeners = []  # Обработчики цен (symbol, price) для публичного WebSocket
+    @classmethod
+    def from_env(cls, symbols: List[str]) -> 'MockExchange':
+        """Имитация с параметрами из переменных окружения MOCK_*"""
+        return cls(
+            symbols,
+            start_price=float(os.getenv('MOCK_START_PRICE', 1.0)),
+            volatility=float(os.getenv('MOCK_VOLATILITY', 0.001)),
+            latency=float(os.getenv('MOCK_LATENCY', 0.0)),
+            jitter=float(os.getenv('MOCK_JITTER', 0.0)),
+            error_rate=float(os.getenv('MOCK_ERROR_RATE', 0.0)),
+            balance=float(os.getenv('MOCK_BALANCE', 10000.0))
+        )
+    def request(self, method: str):
+        """Учет запроса, задержка и случайная ошибка"""
+        with self.lock:
+            self.request_counts[method] = self.request_counts.get(method, 0) + 1
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise MockExchangeError(f"Имитированная ошибка {method}")
+    @staticmethod
+    def response(result: Dict[str, Any]) -> Dict[str, Any]:
+        return {'retCode': 0, 'retMsg': 'OK', 'result': result, 'retExtInfo': {}, 'time': int(time.time() * 1000)}
+    @staticmethod
+    def paginate(items: List[Dict[str, Any]], limit: Optional[int], cursor: Optional[str]) -> Dict[str, Any]:
+        """Пагинация по курсору, как в API Bybit"""
+        start = int(cursor) if cursor else 0
+        limit = limit or len(items) or 1
+        page = items[start:start + limit]
+        next_cursor = str(start + limit) if start + limit < len(items) else ''
+        return {'list': page, 'nextPageCursor': next_cursor}
+    def emit(self, topic: str, data: List[Dict[str, Any]]):
+        for listener in self.listeners:
+            listener(topic, data)
+    # --- Рыночные данные ---
+    def get_tickers(self, category: str = 'linear', symbol: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self.request('get_tickers')
+        with self.lock:
+            symbols = [symbol] if symbol else list(self.prices)
+            tickers = [{
+                'symbol': s,
+                'lastPrice': f"{self.prices[s]:.6f}",
+                'turnover24h': '1000000',
+                'volume24h': f"{1000000 / self.prices[s]:.2f}"
+            } for s in symbols if s in self.prices]
+        return self.response({'category': category, 'list': tickers})
+    def get_instruments_info(self, category: str = 'linear', symbol: Optional[str] = None,
+                             limit: Optional[int] = None, cursor: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self.request('get_instruments_info')
+        if symbol:
+            items = [self.instruments[symbol]] if symbol in self.instruments else []
+        else:
+            items = list(self.instruments.values())
+        return self.response({'category': category, **self.paginate(items, limit or 500, cursor)})
+    # --- Счет и позиции ---
+    def position_record(self, symbol: str) -> Dict[str, Any]:
+        position = self.positions.get(symbol, {'size': 0.0, 'avg_price': 0.0})
+        size = position['size']
+        price = self.prices.get(symbol, 0)
+        return {
+            'symbol': symbol,
+            'category': 'linear',
+            'positionIdx': 0,
+            'side': 'Buy' if size > 0 else 'Sell' if size < 0 else '',
+            'size': f"{abs(size):.6f}",
+            'avgPrice': f"{position['avg_price']:.6f}",
+            'entryPrice': f"{position['avg_price']:.6f}",
+            'unrealisedPnl': f"{size * (price - position['avg_price']):.6f}" if size else '0',
+            'updatedTime': str(int(time.time() * 1000))
+        }
+    def get_positions(self, category: str = 'linear', symbol: Optional[str] = None, settleCoin: Optional[str] = None,
+                      limit: Optional[int] = None, cursor: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self.request('get_positions')
+        with self.lock:
+            if symbol:
+                items = [self.position_record(symbol)]
+            else:
+                items = [self.position_record(s) for s, p in self.positions.items() if p['size'] != 0]
+        return self.response({'category': category, **self.paginate(items, limit or 20, cursor)})
+    def wallet_record(self) -> Dict[str, Any]:
+        unrealised = sum(p['size'] * (self.prices[s] - p['avg_price']) for s, p in self.positions.items())
+        margin = sum(abs(p['size']) * p['avg_price'] for p in self.positions.values())
+        return {
+            'accountType': 'UNIFIED',
+            'totalWalletBalance': f"{self.balance:.4f}",
+            'totalEquity': f"{self.balance + unrealised:.4f}",
+            'totalAvailableBalance': f"{self.balance + unrealised - margin:.4f}"
+        }
+    def get_wallet_balance(self, accountType: str = 'UNIFIED', **kwargs) -> Dict[str, Any]:
+        self.request('get_wallet_balance')
+        with self.lock:
+            return self.response({'list': [self.wallet_record()]})
+    # --- Ордера ---
+    def order_record(self, order: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'category': 'linear',
+            'symbol': order['symbol'],
+            'orderId': order['orderId'],
+            'orderLinkId': order.get('orderLinkId', ''),
+            'side': order['side'],
+            'orderType': 'Limit',
+            'price': f"{order['price']}",
+            'qty': f"{order['qty']}",
+            'cumExecQty': f"{order.get('cumExecQty', 0)}",
+            'orderStatus': order['orderStatus'],
+            'reduceOnly': order['reduceOnly'],
+            'createdTime': str(int(order['created'] * 1000)),
+            'updatedTime': str(int(time.time() * 1000))
+        }
+    def check_filters(self, symbol: str, qty: str, price: Optional[str], reduceOnly: bool):
+        """Проверка шага количества и цены, минимумов и стоимости ордера, как на бирже"""
+        lot_size_filter = self.instruments[symbol]['lotSizeFilter']
+        if Decimal(str(qty)) % Decimal(lot_size_filter['qtyStep']):
+            raise MockExchangeError("Order quantity has too many decimals", 170137)
+        if float(qty) < float(lot_size_filter['minOrderQty']):
+            raise MockExchangeError("Order quantity below the lower limit", 170136)
+        if float(lot_size_filter['maxOrderQty']) and float(qty) > float(lot_size_filter['maxOrderQty']):
+            raise MockExchangeError("Order quantity exceeded upper limit", 170136)
+        if price is None:
+            return
+        if Decimal(str(price)) % Decimal(self.instruments[symbol]['priceFilter']['tickSize']):
+            raise MockExchangeError("Order price has too many decimals", 170134)
+        if not reduceOnly and float(qty) * float(price) < float(lot_size_filter.get('minNotionalValue') or 0):
+            raise MockExchangeError("Order value exceeded lower limit", 170140)
+    def create_order(self, symbol: str, side: str, orderType: str, qty: str, price: Optional[str],
+                     reduceOnly: bool, orderLinkId: str, received: float) -> Dict[str, Any]:
+        """Принять ордер и сразу исполнить пересекающий рынок (вызывается под self.lock)"""
+        if symbol not in self.prices:
+            raise MockExchangeError(f"Неизвестный символ {symbol}", 10001)
+        if float(qty) <= 0:
+            raise MockExchangeError("Неверное количество", 10001)
+        self.check_filters(symbol, qty, price, reduceOnly)
+        qty = float(qty)
+        order = {
+            'orderId': uuid.uuid4().hex,
+            'orderLinkId': orderLinkId,
+            'symbol': symbol,
+            'side': side,
+            'qty': qty,
+            'price': float(price) if price is not None else self.prices[symbol],
+            'reduceOnly': bool(reduceOnly),
+            'orderStatus': 'New',
+            'created': time.time()
+        }
+        self.order_log.append((symbol, side, received))
+        self.orders[order['orderId']] = order
+        self.emit('order', [self.order_record(order)])
+        # Ордер, пересекающий рынок, исполняется сразу как тейкер
+        if orderType == 'Market' or self.crosses(order, self.prices[symbol]):
+            self.fill(order, self.prices[symbol], self.taker_fee)
+        return order
+    def remove_order(self, orderId: Optional[str]) -> Dict[str, Any]:
+        """Снять ордер с книги (вызывается под self.lock)"""
+        order = self.orders.pop(orderId, None)
+        if order is None:
+            raise MockExchangeError("Order does not exist", 110001)
+        order['orderStatus'] = 'Cancelled'
+        self.emit('order', [self.order_record(order)])
+        return order
+    def place_order(self, category: str = 'linear', symbol: str = '', side: str = 'Buy', orderType: str = 'Limit',
+                    qty: str = '0', price: Optional[str] = None, reduceOnly: bool = False,
+                    orderLinkId: str = '', **kwargs) -> Dict[str, Any]:
+        self.request('place_order')
+        received = time.perf_counter()
+        with self.lock:
+            order = self.create_order(symbol, side, orderType, qty, price, reduceOnly, orderLinkId, received)
+        return self.response({'orderId': order['orderId'], 'orderLinkId': orderLinkId})
+    def cancel_order(self, category: str = 'linear', symbol: str = '', orderId: Optional[str] = None,
+                     orderLinkId: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self.request('cancel_order')
+        with self.lock:
+            order = self.remove_order(orderId)
+        return self.response({'orderId': orderId, 'orderLinkId': order.get('orderLinkId', '')})
+    def amend_order(self, category: str = 'linear', symbol: str = '', orderId: Optional[str] = None,
+                    orderLinkId: Optional[str] = None, qty: Optional[str] = None, price: Optional[str] = None,
+                    **kwargs) -> Dict[str, Any]:
+        self.request('amend_order')
+        with self.lock:
+            order = self.orders.get(orderId)
+            if order is None:
+                raise MockExchangeError("Order does not exist", 110001)
+            self.check_filters(order['symbol'], qty if qty is not None else repr(order['qty']),
+                               price if price is not None else repr(order['price']), order['reduceOnly'])
+            if price is not None:
+                order['price'] = float(price)
+            if qty is not None:
+                order['qty'] = float(qty)
+            self.emit('order', [self.order_record(order)])
+            # Перенесенный через рынок ордер исполняется сразу
+            if self.crosses(order, self.prices[order['symbol']]):
+                self.fill(order, self.prices[order['symbol']], self.taker_fee)
+        return self.response({'orderId': orderId, 'orderLinkId': order.get('orderLinkId', '')})
+    def batch_response(self, category: str, results: List[Dict[str, Any]], errors: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Ответ пакетного метода: результаты и коды ошибок в порядке запроса"""
+        response = self.response({'list': results})
+        response['retExtInfo'] = {'list': errors}
+        return response
+    def place_batch_order(self, category: str = 'linear', request: Optional[List[Dict[str, Any]]] = None,
+                          **kwargs) -> Dict[str, Any]:
+        self.request('place_batch_order')
+        received = time.perf_counter()
+        results, errors = [], []
+        with self.lock:
+            for item in request or []:
+                try:
+                    order = self.create_order(item.get('symbol', ''), item.get('side', 'Buy'),
+                                              item.get('orderType', 'Limit'), item.get('qty', '0'), item.get('price'),
+                                              item.get('reduceOnly', False), item.get('orderLinkId', ''), received)
+                    results.append({'category': category, 'symbol': order['symbol'],
+                                    'orderId': order['orderId'], 'orderLinkId': order['orderLinkId']})
+                    errors.append({'code': 0, 'msg': 'OK'})
+                except MockExchangeError as e:
+                    results.append({'category': category, 'symbol': item.get('symbol', ''),
+                                    'orderId': '', 'orderLinkId': item.get('orderLinkId', '')})
+                    errors.append({'code': e.status_code, 'msg': e.message})
+        return self.batch_response(category, results, errors)
+    def cancel_batch_order(self, category: str = 'linear', request: Optional[List[Dict[str, Any]]] = None,
+                           **kwargs) -> Dict[str, Any]:
+        self.request('cancel_batch_order')
+        results, errors = [], []
+        with self.lock:
+            for item in request or []:
+                try:
+                    order = self.remove_order(item.get('orderId'))
+                    results.append({'category': category, 'symbol': order['symbol'],
+                                    'orderId': order['orderId'], 'orderLinkId': order.get('orderLinkId', '')})
+                    errors.append({'code': 0, 'msg': 'OK'})
+                except MockExchangeError as e:
+                    results.append({'category': category, 'symbol': item.get('symbol', ''),
+                                    'orderId': item.get('orderId', ''), 'orderLinkId': item.get('orderLinkId', '')})
+                    errors.append({'code': e.status_code, 'msg': e.message})
+        return self.batch_response(category, results, errors)
+    def get_open_orders(self, category: str = 'linear', symbol: Optional[str] = None, settleCoin: Optional[str] = None,
+                        limit: Optional[int] = None, cursor: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self.request('get_open_orders')
+        with self.lock:
+            items = [self.order_record(order) for order in self.orders.values()
+                     if symbol is None or order['symbol'] == symbol]
+        return self.response({'category': category, **self.paginate(items, limit or 20, cursor)})
+    # --- Сопоставление ---
+    @staticmethod
+    def crosses(order: Dict[str, Any], price: float) -> bool:
+        if order['side'] == 'Buy':
+            return price <= order['price']
+        return price >= order['price']
+    def fill(self, order: Dict[str, Any], price: float, fee_rate: float):
+        """Исполнить ордер полностью по цене price"""
+        symbol = order['symbol']
+        position = self.positions.setdefault(symbol, {'size': 0.0, 'avg_price': 0.0})
+        qty = order['qty']
+        signed = qty if order['side'] == 'Buy' else -qty
+        if order['reduceOnly']:
+            # Нельзя уменьшить позицию больше ее размера
+            qty = min(qty, abs(position['size']))
+            signed = qty if order['side'] == 'Buy' else -qty
+        size = position['size']
+        if size == 0 or (size > 0) == (signed > 0):
+            position['avg_price'] = (abs(size) * position['avg_price'] + qty * price) / (abs(size) + qty) if qty else position['avg_price']
+        else:
+            closed = min(qty, abs(size))
+            self.balance += closed * (price - position['avg_price']) * (1 if size > 0 else -1)
+            if qty > abs(size):
+                position['avg_price'] = price
+        position['size'] = round(size + signed, 10)
+        if position['size'] == 0:
+            position['avg_price'] = 0.0
+        self.balance -= qty * price * fee_rate
+        order['cumExecQty'] = qty
+        order['orderStatus'] = 'Filled'
+        self.orders.pop(order['orderId'], None)
+        self.emit('order', [self.order_record(order)])
+        self.emit('execution', [{
+            'category': 'linear',
+            'symbol': symbol,
+            'orderId': order['orderId'],
+            'execId': uuid.uuid4().hex,
+            'execType': 'Trade',
+            'side': order['side'],
+            'execPrice': f"{price}",
+            'execQty': f"{qty}",
+            'execFee': f"{qty * price * fee_rate}",
+            'execTime': str(int(time.time() * 1000))
+        }])
+        self.emit('position', [self.position_record(symbol)])
+        self.emit('wallet', [self.wallet_record()])
+    def set_price(self, symbol: str, price: float):
+        """Установить цену и исполнить пересеченные ордера"""
+        with self.lock:
+            self.prices[symbol] = price
+            for order in [o for o in self.orders.values() if o['symbol'] == symbol]:
+                if self.crosses(order, price):
+                    self.fill(order, order['price'], self.maker_fee)
+        for listener in self.price_listeners:
+            listener(symbol, price)
+    def step(self):
+        """Случайный шаг цен всех символов"""
+        for symbol, price in list(self.prices.items()):
+            self.set_price(symbol, price * (1 + self.random.gauss(0, self.volatility)))
+    async def run(self, interval: float = 1.0):
+        """Фоновое движение цен"""
+        while True:
+            await asyncio.sleep(interval)
+            self.step()
+    # --- WebSocket ---
+    async def serve_websockets(self, host: str = '127.0.0.1', port: int = 0):
+        """Поднять публичный (/public) и приватный (/private) WebSocket в формате Bybit v5"""
+        loop = asyncio.get_running_loop()
+        public_clients = {}  # {websocket: подписанные символы}
+        private_clients = set()
+        async def send(websocket, message: str):
+            try:
+                await websocket.send(message)
+            except websockets.ConnectionClosed:
+                pass
+        def broadcast(clients, message: str):
+            # Цены и события могут приходить из потоков бота
+            for websocket in list(clients):
+                loop.call_soon_threadsafe(asyncio.ensure_future, send(websocket, message))
+        def on_price(symbol: str, price: float):
+            message = json.dumps({
+                'topic': f"tickers.{symbol}",
+                'type': 'snapshot',
+                'ts': int(time.time() * 1000),
+                'data': {'symbol': symbol, 'lastPrice': f"{price:.6f}"}
+            })
+            broadcast([ws for ws, symbols in public_clients.items() if symbol in symbols], message)
+        def on_event(topic: str, data: List[Dict[str, Any]]):
+            broadcast(private_clients, json.dumps({'topic': topic, 'creationTime': int(time.time() * 1000), 'data': data}))
+        self.price_listeners.append(on_price)
+        self.listeners.append(on_event)
+        async def handler(websocket):
+            private = websocket.path.rstrip('/').endswith('private')
+            try:
+                async for message in websocket:
+                    request = json.loads(message)
+                    op = request.get('op')
+                    if op == 'ping':
+                        await websocket.send(json.dumps({'success': True, 'ret_msg': 'pong', 'op': 'ping'}))
+                    elif op == 'auth':
+                        private_clients.add(websocket)
+                        await websocket.send(json.dumps({'success': True, 'ret_msg': '', 'op': 'auth'}))
+                    elif op in ('subscribe', 'unsubscribe'):
+                        if not private:
+                            symbols = public_clients.setdefault(websocket, set())
+                            for topic in request.get('args', []):
+                                symbol = topic.split('.', 1)[1]
+                                if op == 'subscribe':
+                                    symbols.add(symbol)
+                                else:
+                                    symbols.discard(symbol)
+                        await websocket.send(json.dumps({'success': True, 'ret_msg': '', 'op': op}))
+                        if op == 'subscribe' and not private:
+                            for topic in request.get('args', []):
+                                symbol = topic.split('.', 1)[1]
+                                if symbol in self.prices:
+                                    on_price(symbol, self.prices[symbol])
+            finally:
+                public_clients.pop(websocket, None)
+                private_clients.discard(websocket)
+        server = await websockets.serve(handler, host, port)
+        port = server.sockets[0].getsockname()[1]
+        return server, f"ws://{host}:{port}/public", f"ws://{host}:{port}/private"
@@ -0,0 +1,158 @@
+"""Подбор n_percent, k_percent и max_position по истории
+
+Перебирает сетку (или случайную выборку) параметров для каждого символа через
+бэктест (backtest.py) в пуле процессов. История цен лежит в разделяемой памяти,
+воркеры читают ее без копирования.
+
+Запуск:
+    python optimize.py --data data/ --symbols AVAXUSDT --n-percent 1:15 --k-percent 1:15 \\
+        --max-position 1,2,5 --output sweep.json --write-config assets_config.json
+"""
+import argparse
+import copy
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+import backtest
+PRICE_FIELDS = ('ts', 'high', 'low', 'close')
+OBJECTIVES = {
+    'pnl': lambda result: result['total_pnl'],
+    'calmar': lambda result: result['total_pnl'] / result['max_drawdown'] if result['max_drawdown'] > 0 else result['total_pnl'],
+}
+# Истории цен, подключенные в воркере {symbol: (shared_memory, массив)}
+_histories = {}
+def parse_range(value: str) -> List[float]:
+    """"1:15" или "1:15:0.5" - диапазон включительно, "1,2,5" - список"""
+    if ':' in value:
+        parts = [float(part) for part in value.split(':')]
+        start, stop = parts[0], parts[1]
+        step = parts[2] if len(parts) > 2 else 1
+        return [round(x, 10) for x in np.arange(start, stop + step / 2, step)]
+    return [float(part) for part in value.split(',') if part.strip()]
+def share_history(prices) -> Tuple[shared_memory.SharedMemory, Dict[str, Any]]:
+    """Положить ts/high/low/close в разделяемую память"""
+    n = len(prices)
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(PRICE_FIELDS) * n * 8))
+    array = np.ndarray((len(PRICE_FIELDS), n), dtype=np.float64, buffer=block.buf)
+    for row, field in enumerate(PRICE_FIELDS):
+        array[row] = prices[field].to_numpy(dtype=np.float64)
+    return block, {'name': block.name, 'shape': array.shape}
+def attach_histories(descriptors: Dict[str, Dict[str, Any]]):
+    """Инициализатор воркера: подключить истории без копирования"""
+    for symbol, descriptor in descriptors.items():
+        block = shared_memory.SharedMemory(name=descriptor['name'])
+        _histories[symbol] = (block, np.ndarray(descriptor['shape'], dtype=np.float64, buffer=block.buf))
+def evaluate_chunk(symbol: str, combos: List[Dict[str, float]], settings: Dict[str, Any],
+                   instrument: Optional[Dict[str, float]]) -> List[Dict[str, Any]]:
+    """Бэктест пачки комбинаций параметров в воркере"""
+    history = _histories[symbol][1]
+    ts, high, low, close = history
+    results = []
+    for combo in combos:
+        result = backtest.backtest_symbol(ts, high, low, close, combo, settings, instrument)
+        results.append({**combo, **result})
+    return results
+def build_combos(n_values: List[float], k_values: List[float], max_values: List[float],
+                 samples: int = 0, seed: int = 0) -> List[Dict[str, float]]:
+    """Сетка параметров или случайная выборка из нее"""
+    grid = list(itertools.product(n_values, k_values, max_values))
+    if samples and samples < len(grid):
+        grid = random.Random(seed).sample(grid, samples)
+    return [{'n_percent': n, 'k_percent': k, 'max_position': m} for n, k, m in grid]
+def optimize_symbol(executor: ProcessPoolExecutor, symbol: str, combos: List[Dict[str, float]],
+                    settings: Dict[str, Any], instrument: Optional[Dict[str, float]], chunk_size: int) -> List[Dict[str, Any]]:
+    """Распределить комбинации символа по воркерам"""
+    futures = [
+        executor.submit(evaluate_chunk, symbol, combos[i:i + chunk_size], settings, instrument)
+        for i in range(0, len(combos), chunk_size)
+    ]
+    results = []
+    for future in futures:
+        results.extend(future.result())
+    return results
+def main():
+    parser = argparse.ArgumentParser(description="Подбор параметров процентной сетки")
+    parser.add_argument('--data', required=True, help="Папка с файлами {SYMBOL}.csv/.parquet")
+    parser.add_argument('--symbols', help="Символы через запятую (по умолчанию все включенные)")
+    parser.add_argument('--config', help="Исходная конфигурация активов: JSON, YAML или CSV")
+    parser.add_argument('--instruments', default='instruments_cache.json', help="Кэш инструментов с фильтрами ордеров")
+    parser.add_argument('--n-percent', default='1:15', help="Значения n_percent: 1:15[:шаг] или список")
+    parser.add_argument('--k-percent', default='1:15', help="Значения k_percent: 1:15[:шаг] или список")
+    parser.add_argument('--max-position', help="Значения max_position (по умолчанию текущее)")
+    parser.add_argument('--samples', type=int, default=0, help="Случайная выборка вместо полной сетки")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--objective', choices=sorted(OBJECTIVES), default='pnl')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=32, help="Комбинаций в одной задаче воркера")
+    parser.add_argument('--top', type=int, default=5, help="Сколько лучших комбинаций печатать")
+    parser.add_argument('--output', help="Файл для всех результатов в JSON")
+    parser.add_argument('--write-config', help="Записать лучшие параметры в JSON конфигурации активов")
+    args = parser.parse_args()
+    settings = backtest.default_settings()
+    assets_config = backtest.load_assets_config(args.config)
+    instruments = backtest.load_instruments(args.instruments)
+    if args.symbols:
+        symbols = [symbol.strip() for symbol in args.symbols.split(',') if symbol.strip()]
+    else:
+        symbols = [symbol for symbol, config in assets_config.items() if config.get('enabled', False)]
+    n_values = parse_range(args.n_percent)
+    k_values = parse_range(args.k_percent)
+    # Загружаем истории один раз и кладем в разделяемую память
+    blocks = []
+    descriptors = {}
+    for symbol in symbols:
+        path = backtest.find_data_file(args.data, symbol)
+        if path is None:
+            print(f"[{symbol}] Нет данных в {args.data}")
+            continue
+        block, descriptor = share_history(backtest.load_prices(path, settings['interval']))
+        blocks.append(block)
+        descriptors[symbol] = descriptor
+    objective = OBJECTIVES[args.objective]
+    report = {}
+    best_config = copy.deepcopy(assets_config)
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=attach_histories,
+                                 initargs=(descriptors,)) as executor:
+            for symbol in descriptors:
+                base = assets_config.get(symbol, backtest.DEFAULT_ASSET_CONFIG)
+                max_values = parse_range(args.max_position) if args.max_position else [base['max_position']]
+                combos = build_combos(n_values, k_values, max_values, args.samples, args.seed)
+                symbol_started = time.perf_counter()
+                results = optimize_symbol(executor, symbol, combos, settings, instruments.get(symbol), args.chunk_size)
+                results.sort(key=objective, reverse=True)
+                report[symbol] = results
+                print(f"[{symbol}] {len(results)} комбинаций за {time.perf_counter() - symbol_started:.2f} сек")
+                print(f"  {'n%':>6} {'k%':>6} {'max_pos':>9} {'PnL':>12} {'Просадка':>10} {'Оборот':>12}")
+                for result in results[:args.top]:
+                    print(f"  {result['n_percent']:>6g} {result['k_percent']:>6g} {result['max_position']:>9g} "
+                          f"{result['total_pnl']:>12.4f} {result['max_drawdown']:>10.4f} {result['turnover']:>12.2f}")
+                if results:
+                    best = results[0]
+                    best_config[symbol] = {
+                        **base,
+                        'n_percent': best['n_percent'],
+                        'k_percent': best['k_percent'],
+                        'max_position': best['max_position']
+                    }
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    print(f"Готово за {time.perf_counter() - started:.2f} сек")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'settings': settings, 'objective': args.objective, 'results': report}, f, indent=2)
+    if args.write_config:
+        with open(args.write_config, 'w', encoding='utf-8') as f:
+            json.dump(best_config, f, indent=2)
+        print(f"Лучшие параметры записаны в {args.write_config}")
+if __name__ == "__main__":
+    main()
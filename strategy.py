@@ -0,0 +1,217 @@
+"""Правила процентной сетки (k_percent/n_percent), общие для бота и бэктеста"""
+import csv
+import json
+import os
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP
+from typing import Dict, Any, Optional, Tuple
+import numpy as np
+try:
+    import yaml
+except ImportError:
+    yaml = None
+# Цена отсчета обновляется раз в 24 часа
+REFERENCE_RESET_INTERVAL = 24 * 3600
+# Настройки бота по умолчанию
+BUY_PERCENT = 30  # Покупаем 30% от позиции
+SELL_PERCENT = 35  # Продаем 35% от позиции
+PRICE_OFFSET = 0.3  # Отступ 0.3% для limit ордеров
+ORDER_TTL = 2 * 3600  # 2 часа TTL ордера
+MIN_LOT_USD = 5.0  # Минимальный лот $5
+# Фильтры инструмента, пока они не загружены с биржи (шаг лота 0.1, как у бота)
+DEFAULT_INSTRUMENT = {'qty_step': 0.1, 'tick_size': 0.0001, 'min_order_qty': 0.1, 'max_order_qty': 0, 'min_notional': 0}
+# Конфигурация активов по умолчанию
+DEFAULT_ASSETS_CONFIG = {
+    'SENDUSDT': {'n_percent': 11, 'k_percent': 9, 'enabled': True, 'max_position': 30.0},
+    'AVAXUSDT': {'n_percent': 3, 'k_percent': 1, 'enabled': True, 'max_position': 1.0},
+    'HOMEUSDT': {'n_percent': 3, 'k_percent': 2, 'enabled': True, 'max_position': 390.0},
+    'XRPUSDT': {'n_percent': 11, 'k_percent': 9, 'enabled': True, 'max_position': 6.0},
+    'DOGEUSDT': {'n_percent': 3, 'k_percent': 1, 'enabled': True, 'max_position': 70.0},
+    'HYPEUSDT': {'n_percent': 3, 'k_percent': 2, 'enabled': True, 'max_position': 0.34},
+    'HIFIUSDT': {'n_percent': 3, 'k_percent': 2, 'enabled': False, 'max_position': 216.0},
+    'ALUUSDT': {'n_percent': 1, 'k_percent': 1, 'enabled': True, 'max_position': 270.0},
+    'SAROSUSDT': {'n_percent': 8, 'k_percent': 11, 'enabled': True, 'max_position': 42.0},
+    'MUSDT': {'n_percent': 4, 'k_percent': 3, 'enabled': True, 'max_position': 15.0},
+    'MYXUSDT': {'n_percent': 13, 'k_percent': 14, 'enabled': True, 'max_position': 12.0},
+    'OGUSDT': {'n_percent': 13, 'k_percent': 1, 'enabled': True, 'max_position': 1.2},
+    'ORDERUSDT': {'n_percent': 10, 'k_percent': 5, 'enabled': True, 'max_position': 108.0},
+    'OMNIUSDT': {'n_percent': 10, 'k_percent': 6, 'enabled': True, 'max_position': 5.0},
+    'CYBERUSDT': {'n_percent': 9, 'k_percent': 6, 'enabled': True, 'max_position': 9.0},
+    'IDEXUSDT': {'n_percent': 14, 'k_percent': 6, 'enabled': True, 'max_position': 180.0},
+    'API3USDT': {'n_percent': 13, 'k_percent': 2, 'enabled': True, 'max_position': 15.0},
+    'MAVUSDT': {'n_percent': 11, 'k_percent': 4, 'enabled': True, 'max_position': 200.0},
+    'REXUSDT': {'n_percent': 10, 'k_percent': 2, 'enabled': True, 'max_position': 330.0},
+    'CROUSDT': {'n_percent': 14, 'k_percent': 1, 'enabled': True, 'max_position': 55.0},
+    'DOLOUSDT': {'n_percent': 15, 'k_percent': 3, 'enabled': True, 'max_position': 80.0},
+    'SIRENUSDT': {'n_percent': 15, 'k_percent': 2, 'enabled': True, 'max_position': 160.0},
+}
+ASSET_FIELDS = ('n_percent', 'k_percent', 'max_position')
+def normalize_asset_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Проверить и привести к типам настройки одного актива"""
+    missing = [field for field in ASSET_FIELDS if config.get(field) in (None, '')]
+    if missing:
+        raise ValueError(f"нет полей {', '.join(missing)}")
+    enabled = config.get('enabled', True)
+    if isinstance(enabled, str):
+        enabled = enabled.strip().lower() in ('1', 'true', 'yes', 'on', 'да')
+    return {
+        'n_percent': float(config['n_percent']),
+        'k_percent': float(config['k_percent']),
+        'enabled': bool(enabled),
+        'max_position': float(config['max_position'])
+    }
+def load_assets_file(path: str) -> Dict[str, Dict[str, Any]]:
+    """Конфигурация активов из JSON, YAML или CSV (symbol,n_percent,k_percent,max_position,enabled)"""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if extension == '.csv':
+            entries = list(csv.DictReader(f))
+        elif extension in ('.yaml', '.yml'):
+            if yaml is None:
+                raise ValueError("для YAML нужен пакет pyyaml")
+            entries = yaml.safe_load(f) or {}
+        else:
+            entries = json.load(f)
+    # Словарь {symbol: настройки} или список записей с полем symbol
+    if isinstance(entries, dict):
+        entries = [{**config, 'symbol': symbol} for symbol, config in entries.items()]
+    assets = {}
+    for entry in entries:
+        symbol = str(entry.get('symbol') or '').strip().upper()
+        if not symbol:
+            raise ValueError(f"{path}: запись без символа")
+        try:
+            assets[symbol] = normalize_asset_config(entry)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{path}: {symbol}: {e}")
+    return assets
+# Знаков после запятой в частном value/step: отбрасывает двоичный шум float перед округлением до шага
+QUANTIZE_PRECISION = Decimal('1e-9')
+def to_decimal(value: float) -> Decimal:
+    """Точное десятичное значение из float (кратчайшее представление, без двоичного шума)"""
+    decimal = Decimal(repr(float(value))).normalize()
+    # 1E+1 -> 10, чтобы количество печаталось без экспоненты
+    return decimal.quantize(Decimal(1)) if decimal == decimal.to_integral_value() else decimal
+class Quantizer:
+    """Количество и цена ордера в целых шагах qtyStep/tickSize с учетом minOrderQty, maxOrderQty и minNotionalValue"""
+    __slots__ = ('qty_step', 'tick_size', 'min_steps', 'max_steps', 'min_notional')
+    def __init__(self, qty_step: float, tick_size: float = 0.0001, min_qty: float = 0,
+                 max_qty: float = 0, min_notional: float = 0):
+        self.qty_step = to_decimal(qty_step)
+        self.tick_size = to_decimal(tick_size)
+        self.min_steps = max(self.steps(min_qty, self.qty_step, ROUND_CEILING), 1)
+        self.max_steps = self.steps(max_qty, self.qty_step, ROUND_FLOOR)  # 0 - без ограничения
+        self.min_notional = to_decimal(min_notional)
+    @staticmethod
+    def steps(value, step: Decimal, rounding: str) -> int:
+        """Число целых шагов в value с заданным округлением"""
+        quotient = (value if isinstance(value, Decimal) else to_decimal(value)) / step
+        return int(quotient.quantize(QUANTIZE_PRECISION).to_integral_value(rounding))
+    def notional_steps(self, price: float) -> int:
+        """Минимум шагов количества, при котором стоимость ордера не меньше minNotionalValue"""
+        if not self.min_notional or price <= 0:
+            return 0
+        return self.steps(self.min_notional / to_decimal(price), self.qty_step, ROUND_CEILING)
+    def order_qty(self, qty: float, price: float = 0, reduce_only: bool = False, position: float = 0) -> Decimal:
+        """Количество ордера: ближайший шаг, не меньше минимумов и не больше maxOrderQty; reduceOnly - без minNotionalValue и не больше позиции"""
+        notional_steps = 0 if reduce_only else self.notional_steps(price)
+        steps = max(self.steps(qty, self.qty_step, ROUND_HALF_UP), self.min_steps, notional_steps)
+        if self.max_steps:
+            steps = min(steps, self.max_steps)
+        if reduce_only and position:
+            steps = min(steps, self.steps(abs(position), self.qty_step, ROUND_FLOOR))
+        return steps * self.qty_step
+    def order_price(self, price: float, side: str) -> Decimal:
+        """Цена ордера на шаге цены: покупка вниз, продажа вверх (не ближе к рынку, чем рассчитано)"""
+        ticks = self.steps(price, self.tick_size, ROUND_FLOOR if side == 'Buy' else ROUND_CEILING)
+        return max(ticks, 1) * self.tick_size
+    def min_lot(self, min_lot_usd: float, price: float) -> Decimal:
+        """Минимальный лот: не меньше min_lot_usd и minNotionalValue по цене price, вверх до шага"""
+        if price <= 0:
+            price = 1.0
+        steps = max(self.steps(to_decimal(min_lot_usd) / to_decimal(price), self.qty_step, ROUND_CEILING),
+                    self.min_steps, self.notional_steps(price))
+        return steps * self.qty_step
+    @staticmethod
+    def format(value: Decimal) -> str:
+        """Строка для API без экспоненты"""
+        return format(value, 'f')
+def build_quantizer(instrument: Dict[str, float]) -> Quantizer:
+    """Квантователь количества и цены по фильтрам инструмента (кэш инструментов бота)"""
+    return Quantizer(
+        instrument['qty_step'],
+        instrument['tick_size'],
+        instrument['min_order_qty'],
+        instrument['max_order_qty'],
+        instrument['min_notional']
+    )
+def price_levels(reference_price: float, avg_price: float, k_percent: float, n_percent: float) -> Tuple[float, float]:
+    """Уровни покупки (от цены отсчета) и продажи (от средней цены)"""
+    buy_price_level = reference_price * (1 - k_percent / 100)
+    sell_price_level = avg_price * (1 + n_percent / 100) if avg_price > 0 else 0
+    return buy_price_level, sell_price_level
+def decide_order(current_price: float, position: float, avg_price: float,
+                 buy_price_level: float, sell_price_level: float, min_lot: float,
+                 max_position: float, k_percent: float, buy_percent: float,
+                 sell_percent: float, price_offset: float) -> Optional[Tuple[str, float, float]]:
+    """Решение по активу без активного ордера: (side, lot_size, order_price) или None"""
+    # Условия для покупки (30% от позиции, но не менее минимального лота)
+    buy_condition = (
+            (position <= 0 or
+             (avg_price > 0 and
+              current_price < avg_price * (1 - k_percent / 100))) and
+            current_price < buy_price_level
+    )
+    # Условия для продажи (уменьшение позиции на 35%)
+    sell_condition = (
+            position > 0 and
+            avg_price > 0 and
+            current_price > sell_price_level
+    )
+    # Покупка (30% от позиции, но не менее минимального лота)
+    if buy_condition and abs(position) <= max_position - min_lot:
+        # Рассчитываем размер лота (30% от позиции)
+        position_size = abs(position)
+        lot_size = position_size * (buy_percent / 100)
+        # Проверяем минимальный размер
+        if lot_size < min_lot:
+            lot_size = min_lot
+        # Рассчитываем цену с отступом
+        order_price = current_price * (1 - price_offset / 100)
+        return 'Buy', lot_size, order_price
+    # Продажа (уменьшение позиции на 35%)
+    if sell_condition and abs(position) >= min_lot:
+        # Рассчитываем размер лота (35% от позиции)
+        position_size = abs(position)
+        lot_size = position_size * (sell_percent / 100)
+        # Проверяем минимальный размер
+        if lot_size < min_lot:
+            lot_size = min_lot
+        # Если осталось мало - продаем всё
+        if position_size - lot_size < min_lot:
+            lot_size = position_size
+        # Рассчитываем цену с отступом
+        order_price = current_price * (1 + price_offset / 100)
+        return 'Sell', lot_size, order_price
+    return None
+def decide_orders(current_price: np.ndarray, position: np.ndarray, avg_price: np.ndarray,
+                  buy_price_level: np.ndarray, sell_price_level: np.ndarray, min_lot: np.ndarray,
+                  max_position: np.ndarray, k_percent: np.ndarray, buy_percent: float,
+                  sell_percent: float, price_offset: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """decide_order сразу для массива активов: (маска покупки, маска продажи, лот, цена ордера)"""
+    position_size = np.abs(position)
+    buy_condition = (
+            ((position <= 0) | ((avg_price > 0) & (current_price < avg_price * (1 - k_percent / 100)))) &
+            (current_price < buy_price_level)
+    )
+    sell_condition = (position > 0) & (avg_price > 0) & (current_price > sell_price_level)
+    buy = buy_condition & (position_size <= max_position - min_lot)
+    # Продажа проверяется, только если не сработала покупка
+    sell = ~buy & sell_condition & (position_size >= min_lot)
+    buy_lot = np.maximum(position_size * (buy_percent / 100), min_lot)
+    sell_lot = np.maximum(position_size * (sell_percent / 100), min_lot)
+    # Если после продажи остается меньше минимального лота - продаем всё
+    sell_lot = np.where(position_size - sell_lot < min_lot, position_size, sell_lot)
+    lot_size = np.where(buy, buy_lot, np.where(sell, sell_lot, 0.0))
+    order_price = np.where(buy, current_price * (1 - price_offset / 100),
+                           np.where(sell, current_price * (1 + price_offset / 100), 0.0))
+    return buy, sell, lot_size, order_price